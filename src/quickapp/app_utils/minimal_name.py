@@ -32,51 +32,37 @@ def minimal_names_at_boundaries(objects: List[str], separators=['_', '-']) -> Tu
 
     s0 = separators[0]
 
-    # convert and split to uniform separators
-
-    def convert(x: str) -> str:
-        return x
-        # for s in separators[1:]:
-        #     x = x.replace(s, s0)
-        # return x
-
-    objectsu = list(map(convert, objects))
-    astokens = [x.split(s0) for x in objectsu]
-
-    def is_valid_prefix(p):
-        return all(x.startswith(p) for x in objectsu)
-
-    def is_valid_postfix(p):
-        return all(x.endswith(p) for x in objectsu)
-
-    # max number of tokens
-    ntokens = max(list(map(len, astokens)))
-    prefix = None
-    for i in range(ntokens):
-        toks = astokens[0][:i]
-        p = "".join(t + s0 for t in toks)
-        if is_valid_prefix(p):
-            prefix = p
-        else:
-            break
-    assert prefix is not None
-
-    postfix = None
-    for i in range(ntokens):
-        t0 = astokens[0]
-        toks = t0[len(t0) - i:]
-        x = "".join(s0 + t for t in toks)
-        if is_valid_postfix(x):
-            postfix = x
-        else:
-            break
-
-    assert postfix is not None
+    # Number of tokens in common at the beginning and at the end; each
+    # object must keep at least one token besides the prefix (postfix).
+    # They can only decrease, so each object is compared once, and it
+    # is split into tokens only if it does not have the current prefix
+    # (postfix), which then becomes shorter.
+    t0 = objects[0].split(s0)
+    npre = npost = len(t0) - 1
+    prefix = "".join(t + s0 for t in t0[:npre])
+    postfix = "".join(s0 + t for t in t0[len(t0) - npost:])
+    for x in objects[1:]:
+        if npre and not x.startswith(prefix):
+            tx = x.split(s0)
+            m = min(len(tx) - 1, npre)
+            i = 0
+            while i < m and tx[i] == t0[i]:
+                i += 1
+            npre = i
+            prefix = "".join(t + s0 for t in t0[:npre])
+        if npost and not x.endswith(postfix):
+            tx = x.split(s0)
+            m = min(len(tx) - 1, npost)
+            i = 0
+            while i < m and tx[-1 - i] == t0[-1 - i]:
+                i += 1
+            npost = i
+            postfix = "".join(s0 + t for t in t0[len(t0) - npost:])
 
     n1 = len(prefix)
     n2 = len(postfix)
     # remove it
-    minimal = [o[n1:len(o) - n2] for o in objectsu]
+    minimal = [o[n1:len(o) - n2] for o in objects]
 
     # recreate them to check everything is ok
     objects2 = [prefix + m + postfix for m in minimal]
@@ -139,14 +125,14 @@ def id_field_heuristics(generated):
     # job_id name, otherwise return None
     # (it uses sanitized names)
 
-    alldicts = all([isinstance(g, dict) for g in generated])
+    alldicts = all(isinstance(g, dict) for g in generated)
     if not alldicts:
         return None
 
     # find common fields
     fields = set(generated[0].keys())
     for g in generated:
-        fields = fields & set(g.keys())
+        fields.intersection_update(g.keys())
 
     # print('all fields: %s' % fields)
 
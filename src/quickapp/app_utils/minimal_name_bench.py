@@ -0,0 +1,116 @@
+"""
+    Compares minimal_names_at_boundaries() with the previous
+    implementation, which checked every candidate prefix and postfix
+    against all the names (quadratic in the number of tokens).
+
+        python -m quickapp.app_utils.minimal_name_bench
+"""
+import random
+import time
+from typing import List, Tuple
+
+from .minimal_name import minimal_names_at_boundaries
+
+__all__ = [
+    'minimal_names_at_boundaries_reference',
+    'random_names',
+]
+
+
+def minimal_names_at_boundaries_reference(objects: List[str], separators=['_', '-']) -> Tuple[str, List[str], str]:
+    """ The previous implementation of minimal_names_at_boundaries(). """
+
+    if len(objects) == 1:
+        return '', objects, ''
+
+    s0 = separators[0]
+
+    objectsu = list(objects)
+    astokens = [x.split(s0) for x in objectsu]
+
+    def is_valid_prefix(p):
+        return all(x.startswith(p) for x in objectsu)
+
+    def is_valid_postfix(p):
+        return all(x.endswith(p) for x in objectsu)
+
+    # max number of tokens
+    ntokens = max(list(map(len, astokens)))
+    prefix = None
+    for i in range(ntokens):
+        toks = astokens[0][:i]
+        p = "".join(t + s0 for t in toks)
+        if is_valid_prefix(p):
+            prefix = p
+        else:
+            break
+    assert prefix is not None
+
+    postfix = None
+    for i in range(ntokens):
+        t0 = astokens[0]
+        toks = t0[len(t0) - i:]
+        x = "".join(s0 + t for t in toks)
+        if is_valid_postfix(x):
+            postfix = x
+        else:
+            break
+
+    assert postfix is not None
+
+    n1 = len(prefix)
+    n2 = len(postfix)
+    # remove it
+    minimal = [o[n1:len(o) - n2] for o in objectsu]
+
+    # recreate them to check everything is ok
+    objects2 = [prefix + m + postfix for m in minimal]
+
+    assert objects == objects2, (objects, objects2, (prefix, minimal, postfix))
+    return prefix, minimal, postfix
+
+
+def random_names(n: int, ntokens: int, nprefix: int, npostfix: int,
+                 seed=0) -> List[str]:
+    """ Returns n distinct names of ntokens tokens, of which the first
+        nprefix and the last npostfix are in common. """
+    rng = random.Random(seed)
+    common = ['t%d' % i for i in range(ntokens)]
+    names = set()
+    while len(names) < n:
+        tokens = list(common)
+        for i in range(nprefix, ntokens - npostfix):
+            tokens[i] = 'v%d' % rng.randint(0, n)
+        names.add('_'.join(tokens))
+    return sorted(names)
+
+
+def _time(f, objects, repeat) -> Tuple[float, object]:
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        res = f(objects)
+        t = time.time() - t0
+        best = t if best is None else min(best, t)
+    return best, res
+
+
+def main():
+    cases = [
+        (100, 10, 3, 3),
+        (1000, 10, 3, 3),
+        (1000, 50, 20, 20),
+        (10000, 20, 8, 8),
+    ]
+    print('%6s %7s %7s %12s %12s %8s' % ('names', 'tokens', 'common', 'reference', 'current', 'speedup'))
+    for n, ntokens, nprefix, npostfix in cases:
+        objects = random_names(n, ntokens, nprefix, npostfix)
+        t_ref, res_ref = _time(minimal_names_at_boundaries_reference, objects, 3)
+        t_cur, res_cur = _time(minimal_names_at_boundaries, objects, 3)
+        assert res_ref == res_cur
+        print('%6d %7d %7d %11.4fs %11.4fs %7.1fx' % (n, ntokens, nprefix + npostfix,
+                                                    t_ref, t_cur, t_ref / max(t_cur, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
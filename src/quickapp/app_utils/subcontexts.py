@@ -1,10 +1,13 @@
 # from contracts import contract
+import itertools
+import random
 from typing import Sequence
 
 from .minimal_name import _context_names_heuristics
 
 __all__ = [
     'iterate_context_names',
+    'iterate_context_product',
     'iterate_context_pairs',
     'iterate_context_triplets',
 
@@ -32,21 +35,146 @@ def iterate_context_names(context, it1: Sequence, key: str = None):
     # print('Using names: %s' % names)
 
     for x, name in zip(values, names):
+        if not context.in_shard(name):
+            continue
         e_c = context.child(name)
+        # the children of a context in the shard are all in it
+        e_c.set_shard(None)
         if key is not None:
             keys = {key: x}
             e_c.add_extra_report_keys(**keys)
         yield e_c, x
 
 
+ORDER_SHUFFLE = 'shuffle'
+
+
+def iterate_context_product(context, order=None, seed=None, shard=None,
+                            report_keys=None, **axes):
+    """
+        Creates the child contexts for all the combinations of the values
+        of the axes, given as keyword arguments (name=sequence of values),
+        with minimal names; for two axes this is the same as
+        iterate_context_names_pair().
+
+        Yields tuples (context, x1, x2, ...), with the values in the
+        order of the axes.
+
+        If the context has a shard (see --shard), only the combinations
+        in it are generated.
+
+        The names of each axis are computed once, and the contexts are
+        created only when the combination is reached (the intermediate
+        ones once, when first needed). The leaf contexts are not kept
+        by the iterator nor by their parents, so they are freed once
+        the caller drops them.
+
+        :param order: None (default) for the nested order, or 'shuffle'
+            for a random order (see seed).
+        :param seed: seed for the 'shuffle' order.
+        :param shard: a tuple (i, n): only the combinations whose index
+            (in the nested order) is i modulo n.
+        :param report_keys: None (no report keys), True (the axis names
+            are used as report keys), or a dict axis name -> report key.
+    """
+    names = list(axes)
+    if report_keys is None:
+        keys = [None] * len(names)
+    elif report_keys is True:
+        keys = names
+    else:
+        for k in report_keys:
+            if not k in axes:
+                msg = 'Report key given for unknown axis %r.' % k
+                raise ValueError(msg)
+        keys = [report_keys.get(n, None) for n in names]
+    return _iterate_product(context, [axes[n] for n in names], keys,
+                            order=order, seed=seed, shard=shard)
+
+
+def _iterate_product(context, iterables, keys, order=None, seed=None, shard=None):
+    axes = []
+    for it in iterables:
+        values = list(it)
+        if len(values) == 0:
+            raise ValueError('Empty iterator: %s' % values)
+        axes.append((values, _context_names_heuristics(values)))
+    if not axes:
+        raise ValueError('No axes given.')
+
+    sizes = [len(values) for values, _ in axes]
+    ncells = 1
+    for n in sizes:
+        ncells *= n
+
+    if order is None:
+        cells = itertools.product(*[range(n) for n in sizes])
+        if shard is not None:
+            i, n = _check_shard(shard)
+            cells = itertools.islice(cells, i, None, n)
+    elif order == ORDER_SHUFFLE:
+        indices = list(range(ncells))
+        if shard is not None:
+            i, n = _check_shard(shard)
+            indices = indices[i::n]
+        random.Random(seed).shuffle(indices)
+        cells = (_unravel(k, sizes) for k in indices)
+    else:
+        msg = 'Invalid order %r.' % order
+        raise ValueError(msg)
+
+    sharded = context.get_shard() is not None
+    if sharded:
+        cells = (cell for cell in cells
+                 if context.in_shard('-'.join(axes[d][1][k] for d, k in enumerate(cell))))
+
+    # index prefix -> context
+    created = {(): context}
+
+    def get_context(cell):
+        c = created.get(cell, None)
+        if c is None:
+            parent = get_context(cell[:-1])
+            d = len(cell) - 1
+            values, names = axes[d]
+            c = parent.child(names[cell[d]])
+            if sharded:
+                c.set_shard(None)
+            if keys[d] is not None:
+                c.add_extra_report_keys(**{keys[d]: values[cell[d]]})
+            if len(cell) < len(axes):
+                # the leaves are not kept (nor by their parent)
+                created[cell] = c
+        return c
+
+    for cell in cells:
+        c = get_context(cell)
+        yield (c,) + tuple(axes[d][0][k] for d, k in enumerate(cell))
+
+
+def _check_shard(shard):
+    i, n = shard
+    if not (isinstance(i, int) and isinstance(n, int) and 0 <= i < n):
+        msg = 'Invalid shard %r; need (i, n) with 0 <= i < n.' % (shard,)
+        raise ValueError(msg)
+    return i, n
+
+
+def _unravel(k, sizes):
+    """ Converts the index of a combination to the indices of the values. """
+    cell = []
+    for n in reversed(sizes):
+        k, r = divmod(k, n)
+        cell.append(r)
+    return tuple(reversed(cell))
+
+
 # @contract(it1='seq[>0]', it2='seq[>0]', key1='str|None', key2='str|None')
 def iterate_context_names_pair(context, it1: Sequence, it2: Sequence, key1: str = None, key2: str = None):
     """
         Yields tuples of (context, s1, s2).
     """
-    for cc, x1 in iterate_context_names(context, it1, key=key1):
-        for c, x2 in iterate_context_names(cc, it2, key=key2):
-            yield c, x1, x2
+    return _iterate_product(context, [it1, it2], [key1, key2])
 
 
 iterate_context_pairs = iterate_context_names_pair
@@ -59,10 +187,7 @@ def iterate_context_names_triplet(context, it1: Sequence, it2: Sequence, it3: Se
     """
         Yields tuples of (context, s1, s2, s3).
     """
-    for c1, x1 in iterate_context_names(context, it1, key=key1):
-        for c2, x2 in iterate_context_names(c1, it2, key=key2):
-            for c3, x3 in iterate_context_names(c2, it3, key=key3):
-                yield c3, x1, x2, x3
+    return _iterate_product(context, [it1, it2, it3], [key1, key2, key3])
 
 
 iterate_context_triplets = iterate_context_names_triplet
@@ -72,20 +197,11 @@ def iterate_context_names_quartet(context, it1, it2, it3, it4):
     """
         Yields tuples of (context, s1, s2, s3, s4).
     """
-    for c1, x1 in iterate_context_names(context, it1):
-        for c2, x2 in iterate_context_names(c1, it2):
-            for c3, x3 in iterate_context_names(c2, it3):
-                for c4, x4 in iterate_context_names(c3, it4):
-                    yield c4, x1, x2, x3, x4
+    return _iterate_product(context, [it1, it2, it3, it4], [None] * 4)
 
 
 def iterate_context_names_quintuplet(context, it1, it2, it3, it4, it5):
     """
         Yields tuples of (context, s1, s2, s3, s4).
     """
-    for c1, x1 in iterate_context_names(context, it1):
-        for c2, x2 in iterate_context_names(c1, it2):
-            for c3, x3 in iterate_context_names(c2, it3):
-                for c4, x4 in iterate_context_names(c3, it4):
-                    for c5, x5 in iterate_context_names(c4, it5):
-                        yield c5, x1, x2, x3, x4, x5
+    return _iterate_product(context, [it1, it2, it3, it4, it5], [None] * 5)
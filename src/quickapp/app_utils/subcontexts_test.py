@@ -1,5 +1,7 @@
+import random
 import unittest
 from quickapp.app_utils.minimal_name import minimal_names_at_boundaries, minimal_names
+from quickapp.app_utils.minimal_name_bench import minimal_names_at_boundaries_reference
 
 
 class TestMinimal(unittest.TestCase):
@@ -24,3 +26,24 @@ class TestMinimal(unittest.TestCase):
         self.assertEqual(postfix, '1_64_10')
         
         self.assertEqual(minimal, ['px', 'rob'])
+
+    def test_minimal_names_at_boundaries_reference(self):
+        rng = random.Random(0)
+        cases = [['a_b', 'a_c'], ['a', 'a_b'], ['a_x_b', 'a_y_b', 'a_x_y_b'],
+                 ['x_', 'y_'], ['_x', '_y'], ['a__b', 'a_c_b'], ['ab', 'ac']]
+        for _ in range(2000):
+            n = rng.randint(2, 5)
+            objects = set()
+            while len(objects) < n:
+                ntokens = rng.randint(1, 5)
+                objects.add('_'.join(rng.choice(['a', 'b', '', 'c_d'])
+                                     for _ in range(ntokens)))
+            cases.append(sorted(objects))
+        for objects in cases:
+            try:
+                expected = minimal_names_at_boundaries_reference(objects)
+            except AssertionError:
+                # prefix and postfix overlap
+                self.assertRaises(AssertionError, minimal_names_at_boundaries, objects)
+                continue
+            self.assertEqual(minimal_names_at_boundaries(objects), expected, objects)
@@ -0,0 +1,201 @@
+from weakref import WeakKeyDictionary
+
+from compmake import Promise
+from compmake.ui.ui import generate_job_id
+
+__all__ = [
+    'ChunkedPromise',
+]
+
+
+class ChunkedPromise(Promise):
+    """
+        Promise of one element of the result of a job (a list),
+        as returned by QuickAppContext.comp_map() with chunk_size
+        and comp_small().
+
+        QuickAppContext.comp() and comp_dynamic() accept it as an argument
+        like any other Promise, and pass the element (not the whole chunk)
+        to the function. Anywhere else, use materialize() to get a plain
+        Promise to the element.
+    """
+
+    def __init__(self, job_id, index, item_job_id=None):
+        Promise.__init__(self, job_id)
+        self.index = index
+        # the job id the element would have had in its own job
+        self.item_job_id = item_job_id
+
+    def __repr__(self):
+        return 'ChunkedPromise(%r, %r)' % (self.job_id, self.index)
+
+    def materialize(self, context):
+        """ Defines a job that extracts the element, and returns its Promise. """
+        kwargs = {}
+        if self.item_job_id is not None:
+            kwargs['job_id'] = self.item_job_id
+        else:
+            kwargs['command_name'] = 'chunk_item'
+        return context.comp(_dynreports_chunk_item, self, **kwargs)
+
+
+class _ChunkRef:
+    """ Placeholder for the i-th ChunkedPromise in the arguments of a job. """
+
+    def __init__(self, i):
+        self.i = i
+
+
+_KEEP = object()
+
+
+def rewrite_chunked(x, chunks):
+    """
+        Replaces the ChunkedPromise objects in x (recursively in lists,
+        tuples and dicts) with placeholders; chunks is filled with
+        i -> (Promise of the chunk, index).
+    """
+    def f(y):
+        if isinstance(y, ChunkedPromise):
+            i = len(chunks)
+            chunks[i] = (Promise(y.job_id), y.index)
+            return _ChunkRef(i)
+        return _KEEP
+
+    return _replace(x, f)
+
+
+def resolve_chunked(x, chunks):
+    """ Inverse of rewrite_chunked(), once the chunks are computed. """
+    def f(y):
+        if isinstance(y, _ChunkRef):
+            chunk, index = chunks[y.i]
+            return chunk[index]
+        return _KEEP
+
+    return _replace(x, f)
+
+
+def _replace(x, f):
+    """
+        Replaces recursively (in lists, tuples and dicts) the objects y
+        for which f(y) is not _KEEP. The containers are copied only if
+        something inside them was replaced.
+    """
+    y = f(x)
+    if y is not _KEEP:
+        return y
+    if isinstance(x, Promise):
+        return x
+    if isinstance(x, dict):
+        items = list(x.items())
+        values = [_replace(v, f) for _, v in items]
+        if all(v is v0 for v, (_, v0) in zip(values, items)):
+            return x
+        return type(x)((k, v) for (k, _), v in zip(items, values))
+    if isinstance(x, (list, tuple)):
+        values = [_replace(v, f) for v in x]
+        if all(v is v0 for v, v0 in zip(values, x)):
+            return x
+        return type(x)(values)
+    return x
+
+
+def _dynreports_chunk_call(function, args, kw, chunks):
+    """ Calls the function after replacing the placeholders. """
+    args = resolve_chunked(args, chunks)
+    kw = resolve_chunked(kw, chunks)
+    return function(*args, **kw)
+
+
+def _dynreports_chunk_item(x):
+    return x
+
+
+def _dynreports_map_chunk(function, elements, kw):
+    """ Used by comp_map(): applies the function to each element. """
+    return [function(x, **kw) for x in elements]
+
+
+class SmallJobsBuffer:
+    """ Calls buffered by QuickAppContext.comp_small(), to become one job. """
+
+    def __init__(self, context, job_id, extra_dep):
+        self.context = context
+        # the full id of the chunk job that will be defined
+        self.job_id = job_id
+        self.extra_dep = extra_dep
+        self.extra_ids = frozenset(p.job_id for p in extra_dep)
+        self.calls = []
+
+
+# compmake Context -> dict job prefix -> SmallJobsBuffer
+_small_buffers = WeakKeyDictionary()
+
+
+def add_small_job(context, f, args, kwargs, extra_dep, item_job_id, chunk_size):
+    """
+        Buffers the call f(*args, **kwargs) and returns a ChunkedPromise
+        of its result. The buffer of the context's compmake Context and
+        job prefix is turned into a job when it has chunk_size calls, or
+        when the extra dependencies change.
+    """
+    cc = context.cc
+    prefix = context.get_comp_prefix()
+    buffers = _small_buffers.setdefault(cc, {})
+    b = buffers.get(prefix, None)
+    if b is not None and b.extra_ids != frozenset(p.job_id for p in extra_dep):
+        flush_buffer(b)
+        b = None
+    if b is None:
+        cc.comp_prefix(prefix)
+        # reserve the id now, as the promises need it
+        job_id = generate_job_id(f.__name__ + '_small', cc)
+        b = buffers[prefix] = SmallJobsBuffer(context, job_id, extra_dep)
+    b.calls.append((f, args, kwargs))
+    promise = ChunkedPromise(b.job_id, len(b.calls) - 1, item_job_id=item_job_id)
+    if len(b.calls) >= chunk_size:
+        flush_buffer(b)
+    return promise
+
+
+def flush_buffer(b):
+    """ Defines the chunk job for the buffered calls. """
+    cc = b.context.cc
+    buffers = _small_buffers.get(cc, {})
+    for prefix, b2 in list(buffers.items()):
+        if b2 is b:
+            del buffers[prefix]
+    previous = cc.get_comp_prefix()
+    # the job id is already complete
+    cc.comp_prefix(None)
+    try:
+        b.context._comp_now(_dynreports_small_chunk, (b.calls,),
+                            dict(extra_dep=b.extra_dep, job_id=b.job_id))
+    finally:
+        cc.comp_prefix(previous)
+
+
+def flush_small_jobs(cc, job_ids=None):
+    """
+        Defines the jobs for the calls buffered by comp_small() in the
+        given compmake Context: all of them, or only the chunks with
+        the given job ids.
+    """
+    for b in list(_small_buffers.get(cc, {}).values()):
+        if job_ids is None or b.job_id in job_ids:
+            flush_buffer(b)
+
+
+def flush_referenced(cc, promises):
+    """ Defines the buffered chunk jobs referenced by the promises. """
+    if isinstance(promises, Promise):
+        promises = [promises]
+    job_ids = set(p.job_id for p in promises if isinstance(p, Promise))
+    if job_ids:
+        flush_small_jobs(cc, job_ids)
+
+
+def _dynreports_small_chunk(calls):
+    """ Executes the calls buffered by comp_small(). """
+    return [f(*args, **kwargs) for f, args, kwargs in calls]
@@ -1,24 +1,65 @@
+import copy
 import os
+import pickle
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, TypeVar, Callable
 
 import six
 
 from compmake import Context, Promise
 from compmake.context import load_static_storage
+from compmake.jobs.queries import jobs_defined
 from conf_tools import GlobalConfig
 from contracts import  contract, describe_type
 from contracts.utils import raise_wrapped
+from .chunks import (ChunkedPromise, rewrite_chunked, resolve_chunked,
+                     add_small_job, flush_small_jobs, flush_referenced,
+                     _dynreports_chunk_call, _dynreports_map_chunk)
+from .extra_deps import ExtraDeps
+from .job_registry import JobRegistry
 from .report_manager import ReportManager
 from .resource_manager import ResourceManager
+from .shards import in_shard
+from .tree_stats import ContextTreeStats, ContextTreeNode
+from .rm import comp_store_shared
 from zuper_commons.types import check_isinstance
+from quickapp import logger
 
 __all__ = [
     'CompmakeContext',
     'QuickAppContext',
 ]
 
+# Reserved keyword arguments of compmake's comp()
+COMPMAKE_ARGS = ['job_id', 'extra_dep', 'command_name', 'needs_context']
+
+# Default number of calls to comp_small() fused in one job.
+SMALL_CHUNK_SIZE = 100
+
+# Default maximum number of report managers merged by one job.
+MERGE_FAN_IN = 16
+
+# Executors for define_children_parallel()
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+EXECUTORS = [EXECUTOR_THREAD, EXECUTOR_PROCESS]
+
 
 class QuickAppContext:
+    # Grids of parameters can create a very large number of contexts;
+    # the lists and registries are created only when needed, the
+    # report keys and extra dependencies are shared with the parent,
+    # and the parent does not keep the children alive.
+    __slots__ = (
+        'cc', '_qapp', '_parent', '_job_prefix', 'private_report_manager',
+        '_report_manager', '_resource_manager', '_output_dir',
+        '_node', '_has_branched', '_stats', '_extra_dep',
+        '_job_registry', '_report_keys', '_owns_report_keys',
+        '_promise', '_promise_job_id', '_reports_chunks', 'dynamic_context_size',
+        '_children', 'merge_fan_in', 'small_chunk_size', '_shard',
+        '__weakref__',
+    )
 
     def __init__(self, cc: Context, qapp, parent, job_prefix,
                  output_dir, extra_dep: List = None, resource_manager=None,
@@ -26,8 +67,6 @@ class QuickAppContext:
                  report_manager=None):
         check_isinstance(cc, Context)
         check_isinstance(parent, (CompmakeContext, type(None)))
-        if extra_dep is None:
-            extra_dep = []
         self.cc = cc
         # can be removed once subtask() is removed
         self._qapp = qapp
@@ -49,26 +88,135 @@ class QuickAppContext:
         self._report_manager = report_manager
         self._resource_manager = resource_manager
         self._output_dir = output_dir
-        self.n_comp_invocations = 0
-        self._extra_dep = extra_dep
-        self._jobs = {}
+        # comp() invocations and dynamic jobs in this context, also
+        # counted in the ancestors; the parent keeps weak references
+        # to the children
+        self._node = ContextTreeNode(None if parent is None else parent._node)
+        self._children = None
+        # True if this context or a descendant used comp_dynamic()
+        self._has_branched = False
+        # shared by the whole tree of contexts
+        self._stats = ContextTreeStats() if parent is None else parent._stats
+        self._stats.n_contexts += 1
+        # shared, deduplicated chain of the extra dependencies
+        self._extra_dep = ExtraDeps.from_list(extra_dep)
+        # jobs defined in this context and in the linked ones (lazy)
+        self._job_registry = None
         if extra_report_keys is None:
             extra_report_keys = {}
-        self.extra_report_keys = extra_report_keys
+        self._report_keys = extra_report_keys
+        # if False, _report_keys is shared (with the parent or the children)
+        # and must be copied before it can be changed
+        self._owns_report_keys = True
 
         self._promise = None
-
-        self.branched_contexts = []
-        self.branched_children = []
+        self._promise_job_id = None
+        # the reports known when the context was passed to the dynamic jobs
+        # (see ReportManager.table_chunks())
+        self._reports_chunks = None
+        # size in bytes of the pickled context passed to the dynamic jobs,
+        # including the tables of the reports
+        self.dynamic_context_size = None
+
+        # maximum number of report managers merged by one job
+        self.merge_fan_in = MERGE_FAN_IN if parent is None else parent.merge_fan_in
+        # number of calls to comp_small() fused in one job
+        self.small_chunk_size = SMALL_CHUNK_SIZE if parent is None else parent.small_chunk_size
+        # (i, N) if only the i-th of N shards of the sweeps is defined
+        self._shard = None if parent is None else parent._shard
 
     def __str__(self)->str:
         return 'CompmakeContext(%s)' % (self._job_prefix)
 
+    def __getstate__(self):
+        # Only what is needed to define new jobs: the parent, the jobs
+        # defined so far and the branched contexts are not pickled.
+        d = dict((k, getattr(self, k)) for k in QuickAppContext.__slots__
+                 if k != '__weakref__')
+        d['cc'] = None
+        d['_parent'] = None
+        d['_job_registry'] = None
+        d['_promise'] = None
+        d['_reports_chunks'] = None
+        d['_children'] = None
+        # the copy is the root of a new tree
+        d['_node'] = ContextTreeNode()
+        d['_has_branched'] = False
+        d['_stats'] = ContextTreeStats()
+        d['_stats'].n_contexts = 1
+        return d
+
+    def __setstate__(self, d):
+        for k, v in d.items():
+            setattr(self, k, v)
+
+    @property
+    def _jobs(self) -> JobRegistry:
+        if self._job_registry is None:
+            self._job_registry = JobRegistry()
+        return self._job_registry
+
+    @property
+    def branched_contexts(self) -> list:
+        """ The promises of the merge data of the dynamic jobs defined
+            in this context. """
+        if self._node.branched is None:
+            self._node.set_branched([])
+        return self._node.branched
+
+    @branched_contexts.setter
+    def branched_contexts(self, promises):
+        self._node.set_branched(promises)
+
+    @property
+    def branched_children(self) -> list:
+        """ A new list of the children created with child() that are
+            still in use; the context does not keep them alive. """
+        if self._children is None:
+            return []
+        children = (r() for r in self._children)
+        return [c for c in children if c is not None]
+
+    @branched_children.setter
+    def branched_children(self, children):
+        self._children = [weakref.ref(c) for c in children]
+
+    @property
+    def extra_report_keys(self) -> dict:
+        """ The keys added to the reports of this context. """
+        if not self._owns_report_keys:
+            # copied before it can be changed
+            self._report_keys = dict(self._report_keys)
+            self._owns_report_keys = True
+        return self._report_keys
+
+    @extra_report_keys.setter
+    def extra_report_keys(self, keys):
+        self._report_keys = keys
+        self._owns_report_keys = True
+
+    def _for_dynamic(self) -> "QuickAppContext":
+        """
+            Returns the slim copy of this context that is passed to the
+            dynamic jobs. The report manager is forked (it starts empty;
+            the reports are merged back after the job), so that the reports
+            defined so far are not pickled with every dynamic job; they are
+            stored once by _get_promise() for get_report().
+        """
+        c = copy.copy(self)
+        c._report_keys = dict(self._report_keys)
+        c._owns_report_keys = True
+        c._report_manager = self._report_manager.fork(c)
+        c._resource_manager = self._resource_manager.fork(c)
+        return c
+
     # def all_jobs(self):
     #     return list(self._jobs.values())
 
     def all_jobs_dict(self):
-        return dict(self._jobs)
+        if self._job_registry is None:
+            return {}
+        return self._job_registry.all_jobs()
 
     def checkpoint(self, job_name: str) -> Promise:
         """
@@ -82,10 +230,13 @@ class QuickAppContext:
 
             Returns the checkpoint job (CompmakePromise).
         """
+        # the checkpoint must see the buffered small jobs
+        flush_small_jobs(self.cc)
         job_checkpoint = self.comp(checkpoint, job_name,
-                                   prev_jobs=list(self._jobs.values()),
+                                   prev_jobs=list(self.all_jobs_dict().values()),
                                    job_id=job_name)
-        self._extra_dep.append(job_checkpoint)
+        # the checkpoint depends on all the previous extra dependencies
+        self._extra_dep = self._extra_dep.extend([job_checkpoint], covers_ancestors=True)
         return job_checkpoint
 
     #
@@ -103,12 +254,141 @@ class QuickAppContext:
         if isinstance(other_extra, Promise):
             other_extra = [other_extra]
 
-        extra_dep = self._extra_dep + other_extra
+        extra_dep = self._extra_dep.with_extra(other_extra, cc=self.cc)
         kwargs['extra_dep'] = extra_dep
-        promise = self.cc.comp(f, *args, **kwargs)
-        self._jobs[promise.job_id] = promise
+        return self._comp_now(f, args, kwargs)
+
+    def comp_small(self, f, *args, **kwargs) -> ChunkedPromise:
+        """
+            Like comp(), for jobs that take very little time: the calls
+            are buffered and fused into one job every small_chunk_size
+            calls (see set_small_chunk_size()), to avoid the overhead
+            of compmake for each of them.
+
+            Returns a ChunkedPromise, which can be passed to comp(),
+            comp_dynamic() and add_report() as usual. Note that if one
+            of the calls fails, the whole chunk fails.
+        """
+        self.count_comp_invocations()
+        other_extra = kwargs.pop('extra_dep', [])
+        if isinstance(other_extra, Promise):
+            other_extra = [other_extra]
+        item_job_id = kwargs.pop('job_id', None)
+        kwargs.pop('command_name', None)
+
+        self.cc.comp_prefix(self._job_prefix)
+        extra_dep = self._extra_dep.with_extra(other_extra, cc=self.cc)
+        return add_small_job(self, f, args, kwargs, extra_dep,
+                             item_job_id=item_job_id,
+                             chunk_size=self.small_chunk_size)
+
+    def set_small_chunk_size(self, n: int) -> None:
+        """ Sets the number of calls to comp_small() fused in one job,
+            for this context and the children created afterwards. """
+        if not isinstance(n, int) or n < 1:
+            msg = 'Invalid chunk size %r.' % n
+            raise ValueError(msg)
+        self.small_chunk_size = n
+
+    def _comp_now(self, f, args, kwargs) -> Promise:
+        """ Defines the job; the prefix and extra_dep are already set. """
+        compmake_args = dict((k, kwargs.pop(k)) for k in COMPMAKE_ARGS if k in kwargs)
+        chunks = {}
+        args = rewrite_chunked(args, chunks)
+        kwargs = rewrite_chunked(kwargs, chunks)
+        if chunks:
+            # some arguments are elements of the results of chunk jobs
+            flush_referenced(self.cc, [p for p, _ in chunks.values()])
+            compmake_args.setdefault('command_name', f.__name__)
+            promise = self.cc.comp(_dynreports_chunk_call, f, args, kwargs, chunks,
+                                   **compmake_args)
+        else:
+            kwargs.update(compmake_args)
+            promise = self.cc.comp(f, *args, **kwargs)
+        self._jobs.add(promise)
         return promise
 
+    def comp_map(self, f, iterable, job_id_fn=None, chunk_size=None, **kwargs):
+        """
+            Defines the jobs f(x, **kwargs) for each x in iterable, sharing
+            the per-call work of comp() (prefix, extra dependencies, counting).
+
+            If iterable is a StoreResults, f is applied to the values, and
+            a StoreResults with the same keys is returned; otherwise,
+            a list of promises.
+
+            :param job_id_fn: optional function that returns the job id
+                for an element (for a StoreResults: for a key).
+            :param chunk_size: if given, the elements are grouped into jobs
+                of chunk_size elements each; the promises returned
+                are then ChunkedPromise objects, which can be passed to
+                comp() as usual.
+        """
+        from reprep.report_utils import StoreResults
+        if isinstance(iterable, StoreResults):
+            keys = list(iterable.keys())
+            elements = [iterable[k] for k in keys]
+            id_of = keys
+        else:
+            keys = None
+            elements = list(iterable)
+            id_of = elements
+        if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size < 1):
+            msg = 'Invalid chunk_size %r.' % chunk_size
+            raise ValueError(msg)
+
+        other_extra = kwargs.pop('extra_dep', [])
+        if isinstance(other_extra, Promise):
+            other_extra = [other_extra]
+        command_name = kwargs.pop('command_name', f.__name__)
+
+        self.cc.comp_prefix(self._job_prefix)
+        extra_dep = self._extra_dep.with_extra(other_extra, cc=self.cc)
+
+        def job_id(i):
+            return job_id_fn(id_of[i]) if job_id_fn is not None else None
+
+        promises = []
+        if chunk_size is None:
+            self.count_comp_invocations(len(elements))
+            for i, x in enumerate(elements):
+                compmake_args = dict(extra_dep=extra_dep, command_name=command_name)
+                if job_id_fn is not None:
+                    compmake_args['job_id'] = job_id(i)
+                kw = dict(kwargs)
+                kw.update(compmake_args)
+                promises.append(self._comp_now(f, (x,), kw))
+        else:
+            starts = list(range(0, len(elements), chunk_size))
+            self.count_comp_invocations(len(starts))
+            for start in starts:
+                chunk = elements[start:start + chunk_size]
+                compmake_args = dict(extra_dep=extra_dep,
+                                     command_name=command_name + '_chunk')
+                if job_id_fn is not None:
+                    compmake_args['job_id'] = job_id(start) + '-chunk'
+                p = self._comp_now(_dynreports_map_chunk, (f, chunk, kwargs), compmake_args)
+                for j in range(len(chunk)):
+                    promises.append(ChunkedPromise(p.job_id, j, item_job_id=job_id(start + j)))
+
+        if keys is not None:
+            res = type(iterable)()
+            for k, p in zip(keys, promises):
+                res[k] = p
+            return res
+        return promises
+
+    def comp_store(self, x, name: str = 'shared') -> Promise:
+        """
+            Stores a (large) object once, identified by its content, and
+            returns a Promise to it; pass the Promise to many jobs
+            instead of the object itself.
+        """
+        return comp_store_shared(self, x, name)
+
+    def get_comp_prefix(self):
+        return self._job_prefix
+
     def comp_dynamic(self, f, *args, **kwargs) -> Promise:
         # XXX: we really dont need it
         context = self._get_promise()
@@ -127,14 +407,34 @@ class QuickAppContext:
         #:arg:extra_dep: extra dependencies (not passed as arguments)
         #:arg:command_name: used to define job name if job_id not provided.
 
+        chunks = {}
+        args = rewrite_chunked(args, chunks)
+        kwargs = rewrite_chunked(kwargs, chunks)
+        if chunks:
+            flush_referenced(self.cc, [p for p, _ in chunks.values()])
+            compmake_args['chunks'] = chunks
+        flush_referenced(self.cc, compmake_args.get('extra_dep', []))
+
+        if self._reports_chunks:
+            # passed as job ids: only get_report() loads the tables
+            compmake_args['reports'] = self._reports_chunks
+            tables = [Promise(job_id) for job_id, _ in self._reports_chunks]
+            compmake_args['extra_dep'] = list(compmake_args.get('extra_dep', [])) + tables
+
+        self.count_comp_invocations()
+        self.cc.comp_prefix(self._job_prefix)
         both = self.cc.comp_dynamic(_dynreports_wrap_dynamic, qc=context,
                                     function=f, args=args, kw=kwargs,
                                     **compmake_args)
+        self._jobs.add(both)
 
-        result = self.comp(_dynreports_getres, both)
-        data = self.comp(_dynreports_getbra, both)
-        self.branched_contexts.append(data)
-        return result
+        # No jobs to split the result: the result of the dynamic job is
+        # the result of f, and the job also defines the job with its
+        # merge data, if there is anything to merge (see _dynreports_collect()).
+        self.branched_contexts.append(both)
+        self._stats.n_branched += 1
+        self._set_branched()
+        return both
 
     def comp_config(self, f, *args, **kwargs) -> Promise:
         """
@@ -155,10 +455,71 @@ class QuickAppContext:
             kwargs['command_name'] = f.__name__
         return self.comp_dynamic(wrap_state_dynamic, config_state, f, *args, **kwargs)
 
-    def count_comp_invocations(self)->None:
-        self.n_comp_invocations += 1
-        if self._parent is not None:
-            self._parent.count_comp_invocations()
+    def set_merge_fan_in(self, fan_in: int) -> None:
+        """
+            Sets the maximum number of report managers that are merged by
+            a single job; the report managers of the branched contexts
+            are merged with a tree of jobs with this fan-in.
+            Applies to this context and to the children created afterwards.
+        """
+        if not isinstance(fan_in, int) or fan_in < 2:
+            msg = 'Invalid fan-in %r; need an integer >= 2.' % fan_in
+            raise ValueError(msg)
+        self.merge_fan_in = fan_in
+
+    def set_shard(self, shard) -> None:
+        """
+            Defines only the shard (i, N) of the sweeps done with
+            iterate_context_names() and similar functions in this context
+            and in the children created afterwards (None: all of them).
+            Set by the --shard option.
+        """
+        if shard is not None:
+            i, n = shard
+            if not (isinstance(i, int) and isinstance(n, int) and 0 <= i < n):
+                msg = 'Invalid shard %r; need (i, N) with 0 <= i < N.' % (shard,)
+                raise ValueError(msg)
+        self._shard = shard
+
+    def get_shard(self):
+        return self._shard
+
+    def in_shard(self, name: str) -> bool:
+        """
+            Returns True if the child with the given name belongs to this
+            context's shard (always True if there is no shard). Use it to
+            shard loops that do not use iterate_context_names().
+        """
+        if self._shard is None:
+            return True
+        key = name if self._job_prefix is None else self._job_prefix + '-' + name
+        return in_shard(key, self._shard)
+
+    def count_comp_invocations(self, n: int = 1) -> None:
+        self._node.add_comp(n)
+        self._stats.n_comp_invocations += n
+
+    @property
+    def n_comp_invocations(self) -> int:
+        """ The comp() invocations in this context and its descendants. """
+        if self._parent is None:
+            return self._stats.n_comp_invocations
+        return self._node.n_comp
+
+    def tree_stats(self) -> dict:
+        """
+            Returns the counters for the whole tree of contexts: n_contexts,
+            n_comp_invocations, n_branched (number of comp_dynamic() jobs).
+        """
+        return self._stats.as_dict()
+
+    def _set_branched(self):
+        """ Marks this context and its ancestors as branched. """
+        c = self
+        # the ancestors of a branched context are already marked
+        while c is not None and not c._has_branched:
+            c._has_branched = True
+            c = c._parent
 
     def get_output_dir(self):
         """ Returns a suitable output directory for data files """
@@ -231,12 +592,14 @@ class QuickAppContext:
         else:
             resource_manager = self._resource_manager
 
-        _extra_dep = self._extra_dep + extra_dep
+        _extra_dep = self._extra_dep.extend(extra_dep, cc=self.cc)
 
-        extra_report_keys_ = {}
-        extra_report_keys_.update(self.extra_report_keys)
-        if extra_report_keys is not None:
+        if extra_report_keys:
+            extra_report_keys_ = dict(self._report_keys)
             extra_report_keys_.update(extra_report_keys)
+        else:
+            # shared until add_extra_report_keys() is called
+            extra_report_keys_ = self._report_keys
 
         c1 = CompmakeContext(cc=self.cc,
                              qapp=qapp, parent=self,
@@ -246,9 +609,56 @@ class QuickAppContext:
                              extra_report_keys=extra_report_keys_,
                              output_dir=output_dir,
                              extra_dep=_extra_dep)
-        self.branched_children.append(c1)
+        if extra_report_keys_ is self._report_keys:
+            # both copy it before changing it
+            c1._owns_report_keys = False
+            self._owns_report_keys = False
+        if self._children is None:
+            self._children = []
+        self._children.append(weakref.ref(c1))
         return c1
 
+    def define_children_parallel(self, children, prepare, define, workers=None,
+                                 executor=EXECUTOR_THREAD, **child_options) -> list:
+        """
+            Defines the jobs of many independent child contexts, doing the
+            expensive part of the definition (scanning datasets, building
+            configurations, ...) in parallel.
+
+            For each (name, params) in children, prepare(**params) is called
+            in a pool of threads or processes (executor = 'thread' or
+            'process'; for processes, prepare, params and its result must be
+            picklable). Then, in the order of children, define(c, prepared)
+            is called with c = self.child(name, **child_options), as soon as
+            the result of prepare is available.
+
+            The jobs, reports and resources are defined only by define(),
+            sequentially, so they are exactly as for a sequential
+            definition. Returns the list of the results of define().
+        """
+        if not executor in EXECUTORS:
+            msg = 'Invalid executor %r; expected one of %s.' % (executor, EXECUTORS)
+            raise ValueError(msg)
+        if workers is not None and (not isinstance(workers, int) or workers < 1):
+            msg = 'Invalid number of workers %r.' % workers
+            raise ValueError(msg)
+        children = list(children)
+
+        results = []
+        if workers == 1 or len(children) <= 1:
+            for name, params in children:
+                c = self.child(name, **child_options)
+                results.append(define(c, prepare(**params)))
+            return results
+
+        Executor = ThreadPoolExecutor if executor == EXECUTOR_THREAD else ProcessPoolExecutor
+        with Executor(max_workers=workers) as pool:
+            futures = [pool.submit(prepare, **params) for _, params in children]
+            for (name, _), future in zip(children, futures):
+                c = self.child(name, **child_options)
+                results.append(define(c, future.result()))
+        return results
+
     @contract(job_id=str)
     def add_job_defined_in_this_session(self, job_id):
         self.cc.add_job_defined_in_this_session(self, job_id)
@@ -279,7 +689,7 @@ class QuickAppContext:
         rm = self.get_resource_manager()
         res = rm.get_resource_job(self, rtype, **params)
         assert isinstance(res, Promise), describe_type(res)
-        self._extra_dep.append(res)
+        self._extra_dep = self._extra_dep.extend([res], cc=self.cc)
 
     def get_resource(self, rtype, **params):
         rm = self.get_resource_manager()
@@ -288,7 +698,7 @@ class QuickAppContext:
     @contract(report=Promise, report_type='str')
     def add_report(self, report, report_type, **params):
         rm = self.get_report_manager()
-        params.update(self.extra_report_keys)
+        params.update(self._report_keys)
         rm.add(self, report, report_type, **params)
 
     @contract(returns=Promise, report_type='str')
@@ -302,10 +712,13 @@ class QuickAppContext:
 
     def add_extra_report_keys(self, **keys):
         for k in keys:
-            if k in self.extra_report_keys:
-                msg = 'key %r already in %s' % (k, list(self.extra_report_keys))
+            if k in self._report_keys:
+                msg = 'key %r already in %s' % (k, list(self._report_keys))
                 raise ValueError(msg)
-        self.extra_report_keys.update(keys)
+        if not self._owns_report_keys:
+            self._report_keys = dict(self._report_keys)
+            self._owns_report_keys = True
+        self._report_keys.update(keys)
 
     @contract(returns=Promise)
     def _get_promise(self):
@@ -315,14 +728,19 @@ class QuickAppContext:
             # warnings.warn('XXX: Note that this sometimes creates a context '
             #              'with depth 1; then "delete not root" deletes it.')
             self._promise_job_id = 'context'
-            self._promise = self.comp(load_static_storage, self,
+            slim = self._for_dynamic()
+            self._promise = self.comp(load_static_storage, slim,
                                       job_id=self._promise_job_id)
+            self._reports_chunks = self._report_manager.table_chunks(self)
+            size = len(pickle.dumps(slim, protocol=pickle.HIGHEST_PROTOCOL))
+            self.dynamic_context_size = size + sum(s for _, s in self._reports_chunks)
+            logger.debug('%s: the context of the dynamic jobs takes %d bytes.' %
+                         (self, self.dynamic_context_size))
         return self._promise
 
     def has_branched(self):
         """ Returns True if any comp_dynamic was issued. """
-        return (len(self.branched_contexts) > 0 or
-                any([c.has_branched() for c in self.branched_children]))
+        return self._has_branched
 
 
 def wrap_state(config_state, f, *args, **kwargs):
@@ -341,25 +759,40 @@ def checkpoint(name, prev_jobs):
     pass
 
 
-@contract(context=Context, returns='dict')
-def _dynreports_wrap_dynamic(context, qc, function, args, kw):
+@contract(context=Context)
+def _dynreports_wrap_dynamic(context, qc, function, args, kw, chunks=None, reports=None):
     """
-
+        The dynamic job defined by comp_dynamic(): returns the result
+        of the function; the reports to merge (if any) are the result
+        of the job _merge_data_job_id() that it defines.
     """
 
     qc.cc = context
+    if reports is not None:
+        # for get_report(); only the new reports are merged back
+        qc.get_report_manager().set_inherited(reports, context.get_compmake_db())
+
+    if chunks:
+        args = resolve_chunked(args, chunks)
+        kw = resolve_chunked(kw, chunks)
 
-    res = {}
     try:
-        res['f-result'] = function(qc, *args, **kw)
+        res = function(qc, *args, **kw)
     except TypeError as e:
         msg = 'Could not call %r' % function
         raise_wrapped(TypeError, e, msg, args=args, kw=kw)
 
-    res['context-res'] = context_get_merge_data(qc)
+    flush_small_jobs(context)
+    job_id = _merge_data_job_id(context.currently_executing[-1])
+    context_get_merge_data(qc, job_id=job_id)
     return res
 
 
+def _merge_data_job_id(job_id):
+    """ The id of the job with the merge data of the dynamic job. """
+    return '%s-dynreports-merge' % job_id
+
+
 @contract(branched='list(dict)')
 def _dynreports_merge(branched):
     rm = None
@@ -371,36 +804,95 @@ def _dynreports_merge(branched):
     return dict(report_manager=rm)
 
 
-@contract(res='dict')
-def _dynreports_getres(res):
-    """ gets only the result """
-    return res['f-result']
+@contract(context=Context)
+def _dynreports_collect(context, data, branched, fan_in):
+    """
+        Merges the data with the merge data of the dynamic jobs branched
+        (their ids), once they are done; only the ones that had anything
+        to merge defined their merge job. Returns the merged data, or the
+        promise of the job that merges it.
+    """
+    db = context.get_compmake_db()
+    data = list(data)
+    for job_id in branched:
+        merge_job_id = _merge_data_job_id(job_id)
+        if merge_job_id in jobs_defined(job_id, db):
+            data.append(Promise(merge_job_id))
+    if len(data) == 1:
+        return data[0]
+    return _merge_tree(context, data, fan_in, job_id=context.currently_executing[-1])
 
 
-@contract(res='dict')
-def _dynreports_getbra(res):
-    """ gets only the result """
-    return res['context-res']
+def _merge_tree(cc, data, fan_in, job_id):
+    """
+        Merges with a balanced tree of jobs, each merging at most fan_in
+        report managers, so that no job has to load all of them. The jobs
+        have ids job_id-0, job_id-1, ... (without prefix). Returns the
+        promise of the root of the tree.
+    """
+    previous = cc.get_comp_prefix()
+    cc.comp_prefix(None)
+    try:
+        n = 0
+        while len(data) > 1:
+            nchunks = (len(data) + fan_in - 1) // fan_in
+            bounds = [i * len(data) // nchunks for i in range(nchunks + 1)]
+            chunks = [data[bounds[i]:bounds[i + 1]] for i in range(nchunks)]
+            data = []
+            for chunk in chunks:
+                if len(chunk) == 1:
+                    data.append(chunk[0])
+                else:
+                    data.append(cc.comp(_dynreports_merge, chunk, job_id='%s-%d' % (job_id, n)))
+                    n += 1
+        return data[0]
+    finally:
+        cc.comp_prefix(previous)
 
 
 def get_branched_contexts(context):
     """ Returns all promises created by context_comp_dynamic() for this and children. """
-    res = list(context.branched_contexts)
-    for c in context.branched_children:
-        res.extend(get_branched_contexts(c))
-    return res
+    return context._node.branched_promises()
 
 
-def context_get_merge_data(context):
+def context_get_merge_data(context, job_id=None):
+    """
+        Returns the merge data of the context (with the report manager),
+        or a promise to it.
+
+        If job_id is given (for a dynamic job), the data is the result
+        of a job with that (complete) id, which is not defined if there
+        is nothing to merge; returns None in that case.
+    """
     rm = context.get_report_manager()
     data = [dict(report_manager=rm)]
-
-    data.extend(get_branched_contexts(context))
-
-    if len(data) > 1:
-        return context.cc.comp(_dynreports_merge, data)
-    else:
+    branched = get_branched_contexts(context)
+    fan_in = getattr(context, 'merge_fan_in', MERGE_FAN_IN)
+    cc = context.cc
+
+    if branched:
+        # it is known which ones have something to merge only when they are done
+        previous = cc.get_comp_prefix()
+        kwargs = dict(extra_dep=branched)
+        if job_id is not None:
+            cc.comp_prefix(None)
+            kwargs['job_id'] = job_id
+        try:
+            return cc.comp_dynamic(_dynreports_collect, data,
+                                   [p.job_id for p in branched], fan_in, **kwargs)
+        finally:
+            cc.comp_prefix(previous)
+
+    if job_id is None:
         return data[0]
+    if not rm.allreports:
+        return None
+    previous = cc.get_comp_prefix()
+    cc.comp_prefix(None)
+    try:
+        return cc.comp(_dynreports_merge, data, job_id=job_id)
+    finally:
+        cc.comp_prefix(previous)
 
 
 CompmakeContext = QuickAppContext
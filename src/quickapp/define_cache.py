@@ -0,0 +1,80 @@
+import hashlib
+import inspect
+import os
+import pickle
+
+from compmake.jobs.storage import all_jobs
+
+from .utils import atomic_write
+
+__all__ = [
+    'define_cache_key',
+    'load_define_cache',
+    'save_define_cache',
+]
+
+# The name of the snapshot, in the output directory.
+DEFINE_CACHE_FILENAME = '.quickapp-define-cache.pickle'
+
+# These options do not change the jobs that are defined.
+OPTIONS_NOT_IN_KEY = ['command', 'console', 'reset', 'define_cache', 'redefine',
+                      'contracts', 'profile']
+
+
+def define_cache_key(qapp, options) -> str:
+    """
+        Returns the key of the jobs defined by the application: a hash of
+        the parsed options, of the class and of the source files of
+        the class and its base classes.
+
+        Note that the source of other modules (e.g. of the sub-applications)
+        is not part of the key; use --redefine after changing it.
+    """
+    values = dict((k, v) for k, v in vars(options).items()
+                  if not k.startswith('_') and not k in OPTIONS_NOT_IN_KEY)
+    h = hashlib.sha1()
+    cls = type(qapp)
+    h.update(('%s.%s' % (cls.__module__, cls.__name__)).encode('utf-8'))
+    h.update(repr(sorted(values.items())).encode('utf-8'))
+    h.update(repr(options.get_extra()).encode('utf-8'))
+    for c in cls.__mro__:
+        try:
+            filename = inspect.getsourcefile(c)
+        except TypeError:  # builtin
+            continue
+        if filename is not None and os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def load_define_cache(output_dir, key, db):
+    """
+        Returns the ids of the jobs defined by a previous run with the
+        same key, or None if there is no such snapshot or some of the
+        jobs are not in the DB anymore.
+    """
+    filename = os.path.join(output_dir, DEFINE_CACHE_FILENAME)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        return None
+    if snapshot.get('key', None) != key:
+        return None
+    jobs = snapshot['jobs']
+    if not jobs or not set(jobs) <= set(all_jobs(db)):
+        return None
+    return jobs
+
+
+def save_define_cache(output_dir, key, jobs):
+    """ Saves the ids of the jobs defined, for load_define_cache(). """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    filename = os.path.join(output_dir, DEFINE_CACHE_FILENAME)
+    snapshot = dict(key=key, jobs=sorted(jobs))
+    with atomic_write(filename, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,165 @@
+import hashlib
+
+from compmake import Promise
+
+from .chunks import flush_referenced
+
+__all__ = [
+    'ExtraDeps',
+]
+
+# If there are more extra dependencies than this, the jobs depend on a
+# single barrier job, which depends on all of them.
+BARRIER_THRESHOLD = 8
+
+
+class ExtraDeps:
+    """
+        Persistent (immutable, shared) list of the extra dependencies of
+        a context: each node adds some promises to its parent's.
+
+        Contexts share the chain instead of copying lists; adding
+        dependencies creates a new node.
+
+        If covers_ancestors is True, the promises of this node already
+        depend on all the promises of the ancestors (as for a checkpoint),
+        so the ancestors are not passed to compmake.
+
+        If there are more than BARRIER_THRESHOLD dependencies, compressed()
+        returns a barrier job instead, so that N jobs with the same
+        M dependencies give N + M edges instead of N * M.
+    """
+
+    def __init__(self, parent=None, promises=(), covers_ancestors=False):
+        self.parent = parent
+        self.promises = tuple(promises)
+        self.covers_ancestors = covers_ancestors
+        self._list = None
+        self._ids = None
+        # (compmake context, currently executing) -> barrier Promise
+        self._barriers = None
+
+    def __getstate__(self):
+        # the barriers are specific to the compmake context
+        d = dict(self.__dict__)
+        d['_barriers'] = None
+        return d
+
+    @staticmethod
+    def from_list(extra_dep):
+        """ Converts a list of promises (or an ExtraDeps, or None). """
+        if extra_dep is None:
+            return ExtraDeps()
+        if isinstance(extra_dep, ExtraDeps):
+            return extra_dep
+        if isinstance(extra_dep, Promise):
+            extra_dep = [extra_dep]
+        return ExtraDeps().extend(extra_dep)
+
+    def extend(self, promises, covers_ancestors=False, cc=None):
+        """ Returns a new node with the additional promises
+            (or this same one, if there is nothing new). If the compmake
+            context cc is given, the buffered chunk jobs (see comp_small())
+            that the promises refer to are defined first. """
+        promises = list(promises)
+        if cc is not None:
+            flush_referenced(cc, promises)
+        ids = set(self.job_ids())
+        new = []
+        for p in promises:
+            if not p.job_id in ids:
+                ids.add(p.job_id)
+                new.append(p)
+        if not new and not covers_ancestors:
+            return self
+        return ExtraDeps(parent=self, promises=new, covers_ancestors=covers_ancestors)
+
+    def as_list(self):
+        """ Returns the list of promises, without duplicates and without
+            the ones covered by a checkpoint. Do not modify it. """
+        if self._list is None:
+            if self.covers_ancestors or self.parent is None:
+                res = []
+            else:
+                res = list(self.parent.as_list())
+            seen = set(p.job_id for p in res)
+            for p in self.promises:
+                if not p.job_id in seen:
+                    seen.add(p.job_id)
+                    res.append(p)
+            self._list = res
+            self._ids = seen
+        return self._list
+
+    def job_ids(self):
+        """ Returns the set of job ids in as_list(). Do not modify it. """
+        self.as_list()
+        return self._ids
+
+    def compressed(self, cc):
+        """
+            Returns as_list(), or, if it is longer than BARRIER_THRESHOLD,
+            a list with only a barrier job that depends on all of it.
+
+            The barrier is defined the first time it is needed, and then
+            reused by all the contexts that share this node (e.g. all the
+            children in a grid). Its id does not depend on the job prefix,
+            only on the dependencies and on the job that defines it.
+            It depends on the parent's compressed list, so that the
+            barriers form a chain.
+        """
+        deps = self.as_list()
+        if len(deps) <= BARRIER_THRESHOLD:
+            return deps
+        key = (cc, tuple(cc.currently_executing))
+        if self._barriers is None:
+            self._barriers = {}
+        if not key in self._barriers:
+            if self.covers_ancestors or self.parent is None:
+                inputs = []
+            else:
+                inputs = list(self.parent.compressed(cc))
+            ids = set(p.job_id for p in inputs)
+            for p in self.promises:
+                if not p.job_id in ids:
+                    ids.add(p.job_id)
+                    inputs.append(p)
+            h = hashlib.sha1(repr((key[1], sorted(ids))).encode('utf-8')).hexdigest()
+            job_id = 'dynreports-barrier-%s' % h[:16]
+            if cc.was_job_defined_in_this_session(job_id):
+                barrier = Promise(job_id)
+            else:
+                previous = cc.get_comp_prefix()
+                # the same barrier for all the prefixes
+                cc.comp_prefix(None)
+                try:
+                    barrier = cc.comp(_dynreports_barrier, extra_dep=inputs, job_id=job_id)
+                finally:
+                    cc.comp_prefix(previous)
+            self._barriers[key] = barrier
+        return [self._barriers[key]]
+
+    def with_extra(self, other_extra, cc=None):
+        """ Returns the list of promises (compressed, if cc is given)
+            plus the ones in other_extra that are not already present
+            (defining first the chunk jobs they refer to, if cc is given). """
+        res = self.as_list() if cc is None else self.compressed(cc)
+        if not other_extra:
+            return res
+        if cc is not None:
+            flush_referenced(cc, other_extra)
+        ids = set(p.job_id for p in res)
+        res = list(res)
+        for p in other_extra:
+            if not p.job_id in ids:
+                ids.add(p.job_id)
+                res.append(p)
+        return res
+
+    def __len__(self):
+        return len(self.as_list())
+
+
+def _dynreports_barrier():
+    """ A job that only waits for its dependencies. """
+    pass
@@ -0,0 +1,44 @@
+__all__ = [
+    'JobRegistry',
+]
+
+
+class JobRegistry:
+    """
+        The jobs defined by a context (job_id -> Promise), plus links to
+        the registries of other contexts (e.g. of the sub-applications
+        called with call_recursive()).
+
+        Linking does not copy anything; all_jobs() aggregates the tree
+        when it is needed.
+    """
+
+    def __init__(self):
+        self.own = {}
+        self.linked = []
+
+    def add(self, promise):
+        self.own[promise.job_id] = promise
+
+    def link(self, other):
+        """ Includes the jobs of another registry (also those added later). """
+        if other is self or any(other is x for x in self.linked):
+            return
+        self.linked.append(other)
+
+    def all_jobs(self):
+        """ Returns a new dict job_id -> Promise with the jobs in the tree. """
+        res = {}
+        visited = set()
+        stack = [self]
+        while stack:
+            r = stack.pop()
+            if id(r) in visited:
+                continue
+            visited.add(id(r))
+            res.update(r.own)
+            stack.extend(reversed(r.linked))
+        return res
+
+    def __len__(self):
+        return len(self.all_jobs())
@@ -15,10 +15,15 @@ from decent_params import DecentParams
 from decent_params.utils import UserError, wrap_script_entry_point
 from quickapp import QUICKAPP_COMPUTATION_ERROR, logger
 
+from .chunks import flush_small_jobs
 from .compmake_context import CompmakeContext, context_get_merge_data
+from .define_cache import define_cache_key, load_define_cache, save_define_cache
 from .exceptions import QuickAppException
 from .quick_app_base import QuickAppBase
-from .report_manager import _dynreports_create_index
+from .report_manager import (NAVIGATION_INLINE, NAVIGATION_SIDECAR,
+                             _dynreports_create_index)
+from .shards import (SHARD_INDEX_JOB_ID, merge_shards, parse_shard, shard_index,
+                     shard_storage)
 
 __all__ = [
     'QuickApp',
@@ -31,6 +36,13 @@ class QuickApp(QuickAppBase):
 
     __metaclass__ = ContractsMeta
 
+    def __getstate__(self):
+        # the contexts are not needed by the dynamic jobs
+        d = QuickAppBase.__getstate__(self)
+        d.pop('context', None)
+        d.pop('child_context', None)
+        return d
+
     # Interface to be implemented
     @abstractmethod
     def define_jobs_context(self, context):
@@ -64,6 +76,19 @@ class QuickApp(QuickAppBase):
 
         params.add_flag('console', help='Use Compmake console', group=g)
 
+        params.add_flag('define_cache',
+                        help='Reuse the jobs defined by a previous run with the same '
+                             'options and source, instead of calling define_jobs_context()',
+                        group=g)
+        params.add_flag('redefine', help='With --define_cache: define the jobs anyway, '
+                                         'and update the cache', group=g)
+
+        params.add_string('shard', help='Defines only the shard "i/N" (0 <= i < N) of the '
+                                        'sweeps, with its own DB and index; the reports outside '
+                                        'the sweeps are written by shard 0', default=None, group=g)
+        params.add_int('merge_shards', help='Writes the index of the reports of all N shards, '
+                                            'once they are done', default=None, group=g)
+
         params.add_string('command', short='c',
                           help="Command to pass to compmake for batch mode",
                           default=None, group=g)
@@ -113,11 +138,30 @@ class QuickApp(QuickAppBase):
 
         output_dir = options.output
 
+        if options.merge_shards is not None:
+            n = merge_shards(output_dir, options.merge_shards, compress=options.compress)
+            logger.info('Merged the index of %d reports from %d shards.' %
+                        (n, options.merge_shards))
+            return 0
+
+        shard = None
+        if options.shard is not None:
+            try:
+                shard = parse_shard(options.shard)
+            except ValueError as e:
+                raise UserError(str(e))
+            # Compmake storage for results, separate for each shard
+            storage = shard_storage(output_dir, shard)
+        else:
+            storage = os.path.join(output_dir, 'compmake')
+
         if options.reset:
-            if os.path.exists(output_dir):
-                self.logger.info('Removing output dir %r.' % output_dir)
+            # the other shards share the output dir
+            to_remove = output_dir if shard is None else storage
+            if os.path.exists(to_remove):
+                self.logger.info('Removing output dir %r.' % to_remove)
                 try:
-                    shutil.rmtree(output_dir)
+                    shutil.rmtree(to_remove)
                 except OSError as e:
                     # Directory not empty -- common enough on NFS filesystems
                     # print('errno: %r' % e.errno)
@@ -126,8 +170,6 @@ class QuickApp(QuickAppBase):
                     else:
                         raise
 
-        # Compmake storage for results
-        storage = os.path.join(output_dir, 'compmake')
         logger.debug('Creating storage in %s  (compress = %s)' % (storage, options.compress))
         db = StorageFilesystem(storage, compress=options.compress)
         currently_executing = ['root']
@@ -137,24 +179,55 @@ class QuickApp(QuickAppBase):
         qc = CompmakeContext(cc=oc,
                              parent=None, qapp=self, job_prefix=None,
                              output_dir=output_dir)
+        if shard is not None:
+            qc.set_shard(shard)
+            qc.get_report_manager().index_filename = shard_index(output_dir, shard)
         read_rc_files(oc)
 
-        original = oc.get_comp_prefix()
-        self.define_jobs_context(qc)
-        oc.comp_prefix(original)
-
-        merged = context_get_merge_data(qc)
+        cache_key = None
+        cached_jobs = None
+        if options.define_cache:
+            cache_key = define_cache_key(self, options)
+            if not options.redefine:
+                cached_jobs = load_define_cache(storage, cache_key, db)
 
-        # Only create the index job if we have reports defined
-        # or some branched context (which might create reports)
-        has_reports = len(qc.get_report_manager().allreports) > 0
-        has_branched = qc.has_branched()
-        if has_reports or has_branched:
-            # self.info('Creating reports')
-            oc.comp_dynamic(_dynreports_create_index, merged)
+        if cached_jobs is not None:
+            logger.info('Reusing the %d jobs defined by a previous run.' % len(cached_jobs))
+            oc.reset_jobs_defined_in_this_session(cached_jobs)
         else:
-            pass
-            # self.info('Not creating reports.')
+            original = oc.get_comp_prefix()
+            self.define_jobs_context(qc)
+            # define the jobs still buffered by comp_small()
+            flush_small_jobs(oc)
+            oc.comp_prefix(original)
+
+            rm = qc.get_report_manager()
+            if shard is not None and rm.navigation == NAVIGATION_SIDECAR:
+                # the shards would overwrite each other's sidecars
+                logger.warning('Using inline navigation for the shard.')
+                rm.set_navigation_mode(NAVIGATION_INLINE)
+
+            merged = context_get_merge_data(qc)
+
+            # Only create the index job if we have reports defined
+            # or some branched context (which might create reports)
+            has_reports = len(qc.get_report_manager().allreports) > 0
+            has_branched = qc.has_branched()
+            # each shard has an index job, for --merge_shards
+            if has_reports or has_branched or shard is not None:
+                # self.info('Creating reports')
+                if shard is None:
+                    oc.comp_dynamic(_dynreports_create_index, merged)
+                else:
+                    # its result is read by --merge_shards
+                    oc.comp_dynamic(_dynreports_create_index, merged,
+                                    job_id=SHARD_INDEX_JOB_ID)
+            else:
+                pass
+                # self.info('Not creating reports.')
+
+            if cache_key is not None:
+                save_define_cache(storage, cache_key, oc.get_jobs_defined_in_this_session())
 
         ndefined = len(oc.get_jobs_defined_in_this_session())
         if ndefined == 0:
@@ -238,8 +311,8 @@ This means that if you call it second time with the same arguments,
                 instance.context = child_context
                 res = instance.define_jobs_context(child_context)
 
-            # Add his jobs to our list of jobs
-            context._jobs.update(child_context.all_jobs_dict())
+            # Add his jobs to our list of jobs (without copying them)
+            context._jobs.link(child_context._jobs)
             return res
 
         except Exception as e:
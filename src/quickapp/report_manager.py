@@ -1,10 +1,16 @@
+import hashlib
+import multiprocessing
 import os
+import pickle
 import time
+from collections import deque
 from pprint import pformat
 
 import numpy as np
 
 from compmake import Context, Promise
+from compmake.jobs.dependencies import get_job_userobject_resolved
+from compmake.jobs.storage import get_job_userobject
 try:
     from zuper_commons.ui import duration_compact
 except ImportError:
@@ -36,12 +42,31 @@ try:
 except ImportError:
     from .zuper_commons_patch import natsorted
 from . import logger
-from .rm import write_report_single
+from .utils import atomic_write, coalesced_update
+from .rm import (write_report_single, KeyIndex, ValueIndex, comp_store_shared,
+                 CompactKey, CompactStoreResults, intern_schema,
+                 write_navigation_sidecar, create_links_html_sidecar)
 
 __all__ = [
     'ReportManager',
 ]
 
+# Every write job rewrites the index after writing its report.
+INDEX_UPDATE_EACH = 'each'
+# Write jobs only write their own report; a single job rewrites the index
+# once all of them are done.
+INDEX_UPDATE_COALESCED = 'coalesced'
+
+INDEX_UPDATE_MODES = [INDEX_UPDATE_EACH, INDEX_UPDATE_COALESCED]
+
+# Each report embeds the table of links to the other reports of the same type.
+NAVIGATION_INLINE = 'inline'
+# The links are written once per report type in a sidecar file,
+# and rendered by the browser.
+NAVIGATION_SIDECAR = 'sidecar'
+
+NAVIGATION_MODES = [NAVIGATION_INLINE, NAVIGATION_SIDECAR]
+
 
 class ReportManager:
 
@@ -52,40 +77,130 @@ class ReportManager:
         if index_filename is None:
             index_filename = os.path.join(self.outdir, 'report_index.html')
         self.index_filename = index_filename
-        from reprep.report_utils import StoreResults
-        self.allreports = StoreResults()
-        self.allreports_filename = StoreResults()
-
-        # report_type -> set of keys necessary
+        self.allreports = CompactStoreResults()
+        self.allreports_filename = CompactStoreResults()
+        # The reports added before the fork (see fork()), as the ids and
+        # sizes of the jobs storing the tables (see table_chunks());
+        # loaded by get() when needed, but not merged nor pickled.
+        self._inherited_chunks = ()
+        self._inherited_db = None
+        self._inherited = None
+        # (start, end, job id, size) of the stored tables of allreports
+        self._table_chunks = []
+        # the keys of allreports in the order they were added (lazy)
+        self._report_order = None
+        # keys of the reports defined by every shard (see --shard), which
+        # are only written by shard 0
+        self._shard0_keys = set()
+
+        # report_type -> schema of the keys (see intern_schema())
         self._report_types_format = {}
 
         self.html_resources_prefix = ''
 
+        # how the index is updated by the write jobs
+        self.index_update = INDEX_UPDATE_EACH
+        # how the links to the other reports are written
+        self.navigation = NAVIGATION_INLINE
+        # If not None, the reports are written by one job using
+        # a pool with this many processes.
+        self.write_processes = None
+        self.write_max_in_flight = None
+
         # check if we are called more than once; would be a bug
         self.index_job_created = False
 
         self.static_dir = os.path.join(self.outdir, 'reprep-static')
 
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d['_inherited_chunks'] = ()
+        d['_inherited_db'] = None
+        d['_inherited'] = None
+        d['_table_chunks'] = []
+        d['_report_order'] = None
+        return d
+
+    def fork(self, context) -> "ReportManager":
+        """
+            Returns an empty ReportManager with the same settings, for the
+            reports added by a dynamic job; they are merged back with merge().
+            Use set_inherited() to make the reports of this one available
+            to get().
+        """
+        rm = ReportManager(context, self.outdir, self.index_filename)
+        rm._report_types_format = dict(self._report_types_format)
+        rm.html_resources_prefix = self.html_resources_prefix
+        rm.index_update = self.index_update
+        rm.navigation = self.navigation
+        rm.write_processes = self.write_processes
+        rm.write_max_in_flight = self.write_max_in_flight
+        return rm
+
+    def table_chunks(self, context):
+        """
+            Returns a list of (job id, size in bytes) of the jobs that store
+            the key -> job id tables of all the reports that get() finds.
+            (Job ids and not promises, so that compmake does not load
+            the reports when the tables are loaded.)
+
+            Only the reports added since the last call are stored in a new
+            job, and the tables are merged like the digits of a binary
+            counter: each report is stored O(log N) times, and there are
+            O(log N) tables to pass to the jobs.
+        """
+        chunks = self._table_chunks
+        end = chunks[-1][1] if chunks else 0
+        if len(self.allreports) > end:
+            chunks.append(self._store_table(context, end, len(self.allreports)))
+            while len(chunks) >= 2 and (chunks[-2][1] - chunks[-2][0] <=
+                                        chunks[-1][1] - chunks[-1][0]):
+                b = chunks.pop()
+                a = chunks.pop()
+                chunks.append(self._store_table(context, a[0], b[1]))
+        return list(self._inherited_chunks) + [(job_id, size)
+                                               for _, _, job_id, size in chunks]
+
+    def _store_table(self, context, start, end):
+        if self._report_order is None:
+            self._report_order = list(self.allreports)
+        table = CompactStoreResults()
+        dict.update(table, ((k, self.allreports[k].job_id)
+                            for k in self._report_order[start:end]))
+        size = len(pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL))
+        promise = context.comp(_dynreports_table, table)
+        return start, end, promise.job_id, size
+
+    def set_inherited(self, chunks, db) -> None:
+        """ Sets the reports (the table_chunks() of the report manager
+            that was forked, stored in db) that get() finds besides
+            the ones added. """
+        self._inherited_chunks = tuple(chunks)
+        self._inherited_db = db
+        self._inherited = None
+
     def merge(self, other: "ReportManager") -> None:
         assert isinstance(other, ReportManager)
         """ Merges into this scructure the data from another reportmanager. """
         # print('I have: %d reports' % len(self.allreports))
         # print('merging with another with %d reports' % len(other.allreports))
 
-        for key in other.allreports:
+        # only the keys in common need to be checked
+        common = self.allreports.keys() & other.allreports.keys()
+        for key in common:
             report = other.allreports[key]
+            selfreport = self.allreports[key]
+            msg = 'Found duplicate report %r' % key
+            msg += ' jobs %s and %s' % (report, selfreport)
+            # print(msg)
+            if report.job_id != selfreport.job_id:
+                raise ValueError(msg)
 
-            if key in self.allreports:
-                selfreport = self.allreports[key]
-                msg = 'Found duplicate report %r' % key
-                msg += ' jobs %s and %s' % (report, selfreport)
-                # print(msg)
-                if report.job_id != selfreport.job_id:
-                    raise ValueError(msg)
-
-            filename = other.allreports_filename[key]
-            self.allreports[key] = report
-            self.allreports_filename[key] = filename
+        # the keys are already frozen
+        dict.update(self.allreports, other.allreports)
+        self._report_order = None
+        self._shard0_keys.update(other._shard0_keys)
+        dict.update(self.allreports_filename, other.allreports_filename)
 
     def set_html_resources_prefix(self, prefix):
         """
@@ -95,20 +210,90 @@ class ReportManager:
         """
         self.html_resources_prefix = prefix + '-'
 
+    def set_index_update(self, mode: str):
+        """
+            Sets how the report index is updated:
+
+            'each' (default): every write job rewrites the index;
+                the index is up to date as soon as any report is written.
+
+            'coalesced': the write jobs only write their own report,
+                and one job rebuilds the index when all of them are done.
+                Use this when there are many reports.
+        """
+        if not mode in INDEX_UPDATE_MODES:
+            msg = 'Invalid index update mode %r; use one of %s.' % (mode, INDEX_UPDATE_MODES)
+            raise ValueError(msg)
+        self.index_update = mode
+
+    def set_navigation_mode(self, mode: str):
+        """
+            Sets how the links between reports of the same type are written:
+
+            'inline' (default): each report contains its table of links;
+                all reports of a type are rewritten when one is added.
+
+            'sidecar': the links are written once per report type, in a
+                file next to the reports, and rendered in the browser;
+                adding a report does not rewrite the others.
+                In this mode the index is updated by a single job, as
+                with set_index_update('coalesced').
+        """
+        if not mode in NAVIGATION_MODES:
+            msg = 'Invalid navigation mode %r; use one of %s.' % (mode, NAVIGATION_MODES)
+            raise ValueError(msg)
+        self.navigation = mode
+
+    def set_write_processes(self, processes, max_in_flight=None):
+        """
+            Writes all the reports in a single job, rendering them
+            in parallel in a pool of `processes` processes, instead of
+            using one job per report. Use None to go back to one job
+            per report (the default).
+
+            The reports are loaded one at a time and at most
+            `max_in_flight` (default: 2 * processes) are in memory
+            at the same time. The index is updated once at the end.
+        """
+        if processes is not None:
+            if not isinstance(processes, int) or processes < 1:
+                msg = 'Invalid number of processes %r.' % processes
+                raise ValueError(msg)
+            if max_in_flight is None:
+                max_in_flight = 2 * processes
+            if not isinstance(max_in_flight, int) or max_in_flight < 1:
+                msg = 'Invalid max_in_flight %r.' % max_in_flight
+                raise ValueError(msg)
+        self.write_processes = processes
+        self.write_max_in_flight = max_in_flight
+
     def _check_report_format(self, report_type, **kwargs):
-        keys = sorted(list(kwargs.keys()))
+        """
+            Checks that the report has the same fields as the previous
+            reports of the same type, and returns the schema of its key,
+            which is shared by all the reports of the type.
+        """
         # print('report %r %r' % (report_type, keys))
         if not report_type in self._report_types_format:
-            self._report_types_format[report_type] = keys
-        else:
-            keys0 = self._report_types_format[report_type]
-            if not keys == keys0:
-                msg = 'Report %r %r' % (report_type, keys)
-                msg += '\ndoes not match previous format %r' % keys0
-                raise ValueError(msg)
+            schema = intern_schema(['report'] + list(kwargs))
+            self._report_types_format[report_type] = schema
+        schema = self._report_types_format[report_type]
+        keys0 = [f for f in schema if f != 'report']
+        if len(kwargs) != len(keys0) or not all(f in kwargs for f in keys0):
+            msg = 'Report %r %r' % (report_type, sorted(kwargs))
+            msg += '\ndoes not match previous format %r' % keys0
+            raise ValueError(msg)
+        return schema
 
     def get(self, report_type, **kwargs):
         key = frozendict2(report=report_type, **kwargs)
+        if key not in self.allreports and self._inherited_chunks:
+            if self._inherited is None:
+                self._inherited = {}
+                for job_id, _ in self._inherited_chunks:
+                    self._inherited.update(get_job_userobject(job_id, self._inherited_db))
+            if key in self._inherited:
+                return Promise(self._inherited[key])
         return self.allreports[key]
 
     def add(self, context, report, report_type: str, **kwargs):
@@ -131,18 +316,33 @@ class ReportManager:
                    % describe_type(report))
             raise ValueError(msg)
 
+        from quickapp.chunks import ChunkedPromise
+        if isinstance(report, ChunkedPromise):
+            # the write jobs need a promise of the report itself
+            report = report.materialize(context)
+
         # check the format is ok
-        self._check_report_format(report_type, **kwargs)
+        schema = self._check_report_format(report_type, **kwargs)
 
-        key = frozendict2(report=report_type, **kwargs)
+        kwargs['report'] = report_type
+        key = CompactKey.from_schema(schema, kwargs)
 
+        # (the duplicates of the inherited reports are found by merge())
         if key in self.allreports:
+            previous = self.allreports[key]
             msg = 'Already added report for %s' % key
-            msg += '\n its values is %s' % self.allreports[key]
+            msg += '\n its values is %s' % previous
             msg += '\n new value would be %s' % report
             raise ValueError(msg)
 
         self.allreports[key] = report
+        if self._report_order is not None:
+            self._report_order.append(key)
+        shard = context.get_shard()
+        if shard is not None and shard[0] != 0:
+            # not in a sweep, so every shard defines it; the shards
+            # would write the same file at the same time
+            self._shard0_keys.add(key)
 
         report_type_sane = report_type.replace('_', '')
 
@@ -196,29 +396,67 @@ class ReportManager:
             # no report necessary
             return
 
+        # all the reports are indexed, but not all are written
+        allreports = self.allreports
+        if self._shard0_keys:
+            allreports = CompactStoreResults()
+            dict.update(allreports, ((k, p) for k, p in self.allreports.items()
+                                     if k not in self._shard0_keys))
+
         create_write_jobs(context=context,
                           allreports_filename=self.allreports_filename,
-                          allreports=self.allreports,
+                          allreports=allreports,
                           html_resources_prefix=self.html_resources_prefix,
                           index_filename=self.index_filename,
                           static_dir=self.static_dir,
-                          suffix='write')
+                          suffix='write',
+                          index_update=self.index_update,
+                          navigation=self.navigation,
+                          write_processes=self.write_processes,
+                          write_max_in_flight=self.write_max_in_flight)
 
 
 def create_write_jobs(context, allreports_filename, allreports,
                       html_resources_prefix, index_filename, suffix,
-                      static_dir):
-    # Do not pass as argument, it will take lots of memory!
-    # XXX FIXME: there should be a way to make this update or not
-    # otherwise new report do not appear
-    optimize_space = False
-    if optimize_space and len(allreports_filename) > 100:
-        allreports_filename = context.comp_store(allreports_filename, 'allfilenames')
-    else:
-        allreports_filename = allreports_filename
-
+                      static_dir, index_update=INDEX_UPDATE_EACH,
+                      navigation=NAVIGATION_INLINE,
+                      write_processes=None, write_max_in_flight=None):
     type2reports = sort_by_type(allreports_filename)
-
+    type2index = dict((report_type, ValueIndex(reports.keys()))
+                      for report_type, reports in type2reports.items())
+
+    # Do not pass the maps as arguments to every job: it would make the
+    # job definitions O(N^2). They are stored once, and the jobs get
+    # a Promise to the stored copy.
+    allreports_filename_shared = comp_store_shared(context, allreports_filename,
+                                                   'allfilenames')
+    type2reports_shared = {}
+    for report_type, reports in type2reports.items():
+        type2reports_shared[report_type] = comp_store_shared(context, reports,
+                                                             'filenames')
+
+    sidecar = navigation == NAVIGATION_SIDECAR
+    type2sidecar = {}
+    if sidecar:
+        for report_type, reports in type2reports.items():
+            report_type_sane = report_type.replace('_', '')
+            dirname = os.path.dirname(list(reports.values())[0])
+            sidecar_filename = os.path.join(dirname, '%s%s.navigation.js'
+                                            % (html_resources_prefix, report_type_sane))
+            job_id = jobid_minus_prefix(context, 'navigation-%s-%s'
+                                        % (report_type_sane, suffix))
+            context.comp(write_navigation_sidecar,
+                         reports=type2reports_shared[report_type],
+                         sidecar=sidecar_filename,
+                         index_filename=index_filename,
+                         job_id=job_id)
+            type2sidecar[report_type] = sidecar_filename
+
+    batched = write_processes is not None
+    coalesced = index_update == INDEX_UPDATE_COALESCED or sidecar or batched
+    write_jobs = []
+    # used if batched
+    entries = []
     for key in allreports:
         job_report = allreports[key]
         filename = allreports_filename[key]
@@ -227,10 +465,13 @@ def create_write_jobs(context, allreports_filename, allreports,
 
         # Create the links to report of the same type
         report_type = key['report']
-        other_reports_same_type = type2reports[report_type]
+        if sidecar:
+            other_reports_same_type = None
+        else:
+            other_reports_same_type = type2reports_shared[report_type]
 
         # find the closest report for different type
-        others = find_others(type2reports, key)
+        others = find_others(type2reports, key, type2index)
 
         report_type_sane = report_type.replace('_', '')
         report_nid = html_resources_prefix + report_type_sane
@@ -242,16 +483,48 @@ def create_write_jobs(context, allreports_filename, allreports,
 
         # XXX: not sure why this was here in the first place
 
-        context.comp(write_report_and_update,
-                     report=job_report, report_nid=report_nid,
-                     report_html=filename, all_reports=allreports_filename,
-                     index_filename=index_filename,
-                     write_pickle=False,
-                     this_report=key,
-                     static_dir=static_dir,
-                     other_reports_same_type=other_reports_same_type,
-                     most_similar_other_type=others,
-                     job_id=write_job_id)
+        if batched:
+            entries.append(dict(job_id=job_report.job_id, report_nid=report_nid,
+                                report_html=filename, report_type=report_type,
+                                this_report=key, most_similar_other_type=others))
+            continue
+
+        # In coalesced mode the write jobs do not see the other reports,
+        # so they need not be redone when reports are added.
+        all_reports = None if coalesced else allreports_filename_shared
+
+        write_job = context.comp(write_report_and_update,
+                                 report=job_report, report_nid=report_nid,
+                                 report_html=filename, all_reports=all_reports,
+                                 index_filename=index_filename,
+                                 write_pickle=False,
+                                 this_report=key,
+                                 static_dir=static_dir,
+                                 other_reports_same_type=other_reports_same_type,
+                                 most_similar_other_type=others,
+                                 navigation_sidecar=type2sidecar.get(report_type, None),
+                                 job_id=write_job_id)
+        write_jobs.append(write_job)
+
+    if batched:
+        batch_job_id = jobid_minus_prefix(context, 'dynreports-write-batch-' + suffix)
+        write_job = context.comp_dynamic(_dynreports_write_batch,
+                                         entries=entries,
+                                         type2reports=None if sidecar else type2reports_shared,
+                                         type2sidecar=type2sidecar,
+                                         index_filename=index_filename,
+                                         static_dir=static_dir,
+                                         processes=write_processes,
+                                         max_in_flight=write_max_in_flight,
+                                         extra_dep=list(allreports.values()),
+                                         job_id=batch_job_id)
+        write_jobs.append(write_job)
+
+    if coalesced:
+        index_job_id = jobid_minus_prefix(context, 'index-' + suffix)
+        context.comp(index_reports, reports=allreports_filename_shared,
+                     index=index_filename, extra_dep=write_jobs,
+                     job_id=index_job_id)
 
 
 def jobid_minus_prefix(context, want):
@@ -268,20 +541,23 @@ def jobid_minus_prefix(context, want):
 
 
 def sort_by_type(allreports_filename):
+    index = KeyIndex(allreports_filename.items())
     type2reports = {}
-    for report_type, xs in allreports_filename.groups_by_field_value('report'):
-        fields = xs.remove_field('report')
-        # print(fields)
-        from reprep.report_utils import StoreResults
-        res = StoreResults()
-        for k, v in list(fields.items()):
-            res[k] = v
+    for report_type, rows in index.groups('report', index.all_rows()):
+        res = CompactStoreResults()
+        for row in rows:
+            res[index.key(row, exclude=('report',))] = index.values[row]
         type2reports[report_type] = res
     return type2reports
 
 
-def find_others(type2reports, key):
-    """ find the closest report for different type """
+def find_others(type2reports, key, type2index=None):
+    """
+        find the closest report for different type
+
+        :param type2index: optional dict report type -> ValueIndex of the
+            keys of that type, to be reused across calls.
+    """
     report_type = key['report']
 
     key = dict(**key)
@@ -291,7 +567,10 @@ def find_others(type2reports, key):
     for other_type, other_type_reports in list(type2reports.items()):
         if other_type == report_type:
             continue
-        best = get_most_similar(other_type_reports, key)
+        if type2index is not None:
+            best = type2index[other_type].most_similar(key)
+        else:
+            best = get_most_similar(other_type_reports, key)
         if best is not None:
             others.append((other_type, best, other_type_reports[best]))
 
@@ -301,36 +580,23 @@ def find_others(type2reports, key):
 def get_most_similar(reports_different_type, key):
     """ Returns the report of another type that is most similar to this report. """
 
-    def score(key1):
-        v1 = set(key1.values())
-        v2 = set(key.values())
-        return len(v1 & v2)
-
-    keys = list(reports_different_type.keys())
-    scores = np.array(list(map(score, keys)))
-
-    tie = np.sum(scores == np.max(scores)) > 1
-    if tie:
-        # print('there is a tie: %s,\n %s' % (key, keys))
-        return None
-
-    i = int(np.argmax(scores))
-    best = keys[i]
-
-    return best
+    index = ValueIndex(reports_different_type.keys())
+    return index.most_similar(key)
 
 
 def create_links_html(this_report, other_reports_same_type, index_filename,
                       most_similar_other_type):
-    check_isinstance(other_reports_same_type, 'StoreResults')
     '''
     :param this_report: dictionary with the keys describing the report
     :param other_reports_same_type: StoreResults -> filename
     :returns: html string describing the link
     '''
+    from reprep.report_utils import StoreResults
+    check_isinstance(other_reports_same_type, StoreResults)
+
+    f0 = other_reports_same_type[this_report]
 
     def rel_link(f):  # (this is FROM f0 to f) --- trust me, it's ok
-        f0 = other_reports_same_type[this_report]
         rl = os.path.relpath(f, os.path.dirname(f0))
         return rl
 
@@ -427,18 +693,19 @@ def create_links_html(this_report, other_reports_same_type, index_filename,
 # @contract(returns="list( tuple(str, *))", other_reports_same_type=StoreResults)
 def create_links_html_table(this_report, other_reports_same_type):
     # Iterate over all keys (each key gets a column)
+    index = KeyIndex(other_reports_same_type.items())
+    row = index.find(this_report)
+    if row is None:
+        raise KeyError(this_report)
+    f0 = index.values[row]
 
     def rel_link(f):
-        # TODO: make it relative
-        f0 = other_reports_same_type[this_report]
         rl = os.path.relpath(f, os.path.dirname(f0))
         return rl
 
     cols = []
-    fieldnames = other_reports_same_type.field_names()
-    for field in fieldnames:
-        field_values = other_reports_same_type.field_values(field)
-        field_values = sorted(list(set(field_values)))
+    for field in index.fields:
+        field_values = sorted(index.values_of(field))
         col = []
         for fv in field_values:
             if fv == this_report[field]:
@@ -446,13 +713,12 @@ def create_links_html_table(this_report, other_reports_same_type):
                 res = (str(fv), None)
             else:
                 # this is the variation obtained by changing only one field value
-                variation = dict(**this_report)
-                variation[field] = fv
+                variation = index.variation(row, field, fv)
                 # if it doesn't exist:
-                if not variation in other_reports_same_type:
+                if variation is None:
                     res = ('%s (n/a)' % str(fv), None)
                 else:
-                    res = (fv, rel_link(other_reports_same_type[variation]))
+                    res = (fv, rel_link(index.values[variation]))
             col.append(res)
         cols.append((field, col))
     return cols
@@ -464,29 +730,121 @@ def write_report_and_update(report, report_nid, report_html, all_reports, index_
                             other_reports_same_type,
                             most_similar_other_type,
                             static_dir,
-                            write_pickle=False):
+                            write_pickle=False,
+                            navigation_sidecar=None):
     if not isinstance(report, Report):
         msg = 'Expected Report, got %s.' % describe_type(report)
         raise ValueError(msg)
 
-    links = create_links_html(this_report, other_reports_same_type, index_filename,
-                              most_similar_other_type=most_similar_other_type)
-
-    tree_html = '<pre style="display:none">%s</pre>' % report.format_tree()
-
-    extras = dict(extra_html_body_start=links,
-                  extra_html_body_end=tree_html)
+    extras = create_report_extras(report, report_html, index_filename, this_report,
+                                  other_reports_same_type, most_similar_other_type,
+                                  navigation_sidecar)
 
     report.nid = report_nid
     html = write_report(report=report,
                         report_html=report_html,
                         static_dir=static_dir,
                         write_pickle=write_pickle, **extras)
-    index_reports(reports=all_reports, index=index_filename, update=html)
+    # all_reports is None if the index is updated by a separate job
+    if all_reports is not None:
+        index_reports(reports=all_reports, index=index_filename, update=html)
+    return html
+
+
+def create_report_extras(report, report_html, index_filename, this_report,
+                         other_reports_same_type, most_similar_other_type,
+                         navigation_sidecar=None):
+    """ Returns the extra html (navigation links, tree) to add to a report. """
+    if navigation_sidecar is not None:
+        links = create_links_html_sidecar(this_report, report_html, navigation_sidecar,
+                                          most_similar_other_type=most_similar_other_type)
+    else:
+        links = create_links_html(this_report, other_reports_same_type, index_filename,
+                                  most_similar_other_type=most_similar_other_type)
+
+    tree_html = '<pre style="display:none">%s</pre>' % report.format_tree()
+
+    return dict(extra_html_body_start=links,
+                extra_html_body_end=tree_html)
+
+
+def _dynreports_write_batch(context, entries, type2reports, type2sidecar,
+                            index_filename, static_dir, processes, max_in_flight):
+    """
+        Writes many reports in one job, rendering them in a pool of processes.
+
+        The reports are loaded from the DB one at a time (the entries
+        contain the job ids), and at most max_in_flight are in memory.
+    """
+    db = context.get_compmake_db()
+
+    def tasks():
+        for e in entries:
+            report = get_job_userobject_resolved(e['job_id'], db)
+            if not isinstance(report, Report):
+                msg = 'Expected Report, got %s.' % describe_type(report)
+                raise ValueError(msg)
+            report_type = e['report_type']
+            other_reports_same_type = (type2reports[report_type]
+                                       if type2reports is not None else None)
+            extras = create_report_extras(report, e['report_html'], index_filename,
+                                          e['this_report'], other_reports_same_type,
+                                          e['most_similar_other_type'],
+                                          type2sidecar.get(report_type, None))
+            yield (report, e['report_nid'], e['report_html'], static_dir, extras)
+
+    # We cannot create a pool from a daemon process (e.g. a parmake worker).
+    if processes == 1 or multiprocessing.current_process().daemon:
+        return [_dynreports_render_report(task) for task in tasks()]
+
+    results = []
+    pending = deque()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for task in tasks():
+            pending.append(pool.apply_async(_dynreports_render_report, (task,)))
+            del task
+            while len(pending) >= max_in_flight:
+                results.append(pending.popleft().get())
+        while pending:
+            results.append(pending.popleft().get())
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return results
+
+
+def _dynreports_render_report(task):
+    report, report_nid, report_html, static_dir, extras = task
+    report.nid = report_nid
+    return write_report(report=report, report_html=report_html,
+                        static_dir=static_dir, **extras)
 
 
 # @contract(report=Report, report_html='str')
 def write_report(report, report_html, static_dir, write_pickle=False, **kwargs):
+    """
+        Writes the report to html, unless the html already exists and was
+        written from the same report and arguments. A fingerprint of the
+        inputs is saved in the file <report_html>.sha1 .
+    """
+    fingerprint = report_fingerprint(report, report_html, static_dir,
+                                     write_pickle=write_pickle, **kwargs)
+    fingerprint_file = report_html + '.sha1'
+    if fingerprint is not None and os.path.exists(report_html):
+        try:
+            with open(fingerprint_file) as f:
+                previous = f.read().strip()
+        except IOError:
+            previous = None
+        if previous == fingerprint:
+            logger.debug('Not rewriting unchanged %s ' % friendly_path(report_html))
+            return report_html
+
     logger.debug('Writing to %s ' % friendly_path(report_html))
     #     if False:
     #         # Note here they might overwrite each other
@@ -499,10 +857,32 @@ def write_report(report, report_html, static_dir, write_pickle=False, **kwargs):
                    static_dir=static_dir,
                    **kwargs)
 
+    if fingerprint is not None:
+        with open(fingerprint_file, 'w') as f:
+            f.write(fingerprint)
+    elif os.path.exists(fingerprint_file):
+        os.unlink(fingerprint_file)
+
     # TODO: save hdf format
     return report_html
 
 
+def report_fingerprint(report, *args, **kwargs):
+    """
+        Returns a hash of the report tree and the arguments used to write it,
+        or None if they cannot be pickled.
+    """
+    h = hashlib.sha1()
+    try:
+        h.update(pickle.dumps(report, protocol=pickle.HIGHEST_PROTOCOL))
+        h.update(pickle.dumps((args, sorted(kwargs.items())),
+                              protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        logger.debug('Cannot compute fingerprint: %s' % e)
+        return None
+    return h.hexdigest()
+
+
 # @contract(reports=StoreResults, index=str)
 def index_reports(reports, index, update=None):  # @UnusedVariable
     """
@@ -514,13 +894,23 @@ def index_reports(reports, index, update=None):  # @UnusedVariable
     # print('Updating because of new report %s' % update)
 
     dirname = os.path.dirname(index)
-    if not os.path.exists(dirname):
-        os.makedirs(dirname)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
 
     # logger.info('Writing on %s' % friendly_path(index))
 
-    f = open(index, 'w')
+    # Many write jobs can update the index at the same time (parmake):
+    # the file is replaced atomically, and the updates that arrive while
+    # another process is writing are done by that process once more.
+    def write():
+        with atomic_write(index) as f:
+            write_index(reports, index, f)
+
+    coalesced_update(index + '.lock', write)
+
 
+def write_index(reports, index, f):
+    """ Writes the html of the index for index_reports() to the file object. """
     f.write("""
         <html>
         <head>
@@ -533,18 +923,14 @@ def index_reports(reports, index, update=None):  # @UnusedVariable
         <body>
     """)
 
-    mtime = lambda x: os.path.getmtime(x)
-    existing = list([x for x in list(reports.items()) if os.path.exists(x[1])])
+    # stat each file only once
+    items = list(reports.items())
+    filename2mtime = get_mtimes(filename for _, filename in items)
+    existing = [x for x in items if x[1] in filename2mtime]
 
     # create order statistics
-    alltimes = np.array([mtime(b) for _, b in existing])
-
-    def order(filename):
-        """ returns between 0 and 1 the order statistics """
-        assert os.path.exists(filename)
-        histime = mtime(filename)
-        compare = (alltimes < histime)
-        return np.mean(compare * 1.0)
+    alltimes = np.array([filename2mtime[b] for _, b in existing], dtype='float64')
+    filename2order = dict(zip([b for _, b in existing], order_statistics(alltimes)))
 
     def style_order(order):
         if order > 0.95:
@@ -555,15 +941,17 @@ def index_reports(reports, index, update=None):  # @UnusedVariable
             return "color: gray;"
         return ""
 
+    now = time.time()
+    index_dir = os.path.dirname(os.path.realpath(index))
+
     # @contract(k=dict, filename=str)
     def write_li(k, filename: str, element='li'):
         desc = ",  ".join('%s = %s' % (a, b) for a, b in list(k.items()))
-        href = os.path.relpath(os.path.realpath(filename),
-                               os.path.dirname(os.path.realpath(index)))
-        if os.path.exists(filename):
-            when = duration_compact(time.time() - mtime(filename))
+        href = os.path.relpath(os.path.realpath(filename), index_dir)
+        if filename in filename2mtime:
+            when = duration_compact(now - filename2mtime[filename])
             span_when = '<span class="when">%s ago</span>' % when
-            style = style_order(order(filename))
+            style = style_order(filename2order[filename])
             a = '<a href="%s">%s</a>' % (href, desc)
         else:
             # print('File %s does not exist yet' % filename)
@@ -574,9 +962,9 @@ def index_reports(reports, index, update=None):  # @UnusedVariable
                                                element))
 
     # write the first 10
-    existing.sort(key=lambda x: (-mtime(x[1])))
     nlast = min(len(existing), 10)
-    last = existing[:nlast]
+    newest_first = np.argsort(-alltimes, kind='stable')
+    last = [existing[i] for i in newest_first[:nlast]]
     f.write('<h2 id="last">Last %d report</h2>\n' % (nlast))
 
     f.write('<ul>')
@@ -648,23 +1036,58 @@ def index_reports(reports, index, update=None):  # @UnusedVariable
     </html>
     
     ''')
-    f.close()
+
+
+def get_mtimes(filenames):
+    """ Returns a dict filename -> mtime for the files that exist,
+        calling stat() once per file. """
+    res = {}
+    for filename in filenames:
+        try:
+            res[filename] = os.stat(filename).st_mtime
+        except OSError:
+            pass
+    return res
+
+
+def order_statistics(times):
+    """
+        For each element of the array, returns the fraction of elements
+        that are strictly smaller (between 0 and 1).
+
+        Uses one sort, so it is O(N log N) instead of O(N^2).
+    """
+    times = np.asarray(times, dtype='float64')
+    if len(times) == 0:
+        return np.zeros(0)
+    sorted_times = np.sort(times)
+    smaller = np.searchsorted(sorted_times, times, side='left')
+    return smaller * 1.0 / len(times)
 
 
 def make_sections(allruns, common=None):
-    # print allruns.keys()
+    """
+        Recursively groups the reports by the field with the least
+        number of values. The keys are indexed once (see KeyIndex)
+        and each level of the recursion works on arrays of rows.
+    """
     if common is None:
         common = {}
+    index = KeyIndex(allruns.items())
+    return _make_sections(index, index.all_rows(), common, grouped=())
 
-    # print('Selecting %d with %s' % (len(allruns), common))
 
-    if len(allruns) == 1:
-        key = list(allruns.keys())[0]
-        value = allruns[key]
+def _make_sections(index, rows, common, grouped):
+    # print('Selecting %d with %s' % (len(rows), common))
+
+    if len(rows) == 1:
+        row = rows[0]
+        key = frozendict2(**index.key(row, exclude=grouped))
+        value = index.values[row]
         return dict(type='sample', common=common, key=key, value=value)
 
-    fields_size = [(field, len(list(allruns.groups_by_field_value(field))))
-                   for field in allruns.field_names_in_all_keys()]
+    fields_size = [(field, index.num_values(field, rows))
+                   for field in index.fields_in_all(rows, exclude=grouped)]
 
     # Now choose the one with the least choices
     fields_size.sort(key=lambda x: x[1])
@@ -672,21 +1095,22 @@ def make_sections(allruns, common=None):
     if not fields_size:
         # [frozendict({'i': 1, 'n': 3}), frozendict({'i': 2, 'n': 3}), frozendict({}), frozendict({'i': 0, 'n': 3})]
         msg = 'Not all records of the same type have the same fields'
-        msg += pformat(list(allruns.keys()))
+        msg += pformat([index.key(r, exclude=grouped) for r in rows])
         raise ValueError(msg)
 
     field = fields_size[0][0]
     division = {}
-    for value, samples in allruns.groups_by_field_value(field):
-        samples = samples.remove_field(field)
+    for value, samples in index.groups(field, rows):
         c = dict(common)
         c[field] = value
         try:
-            division[value] = make_sections(samples, common=c)
+            division[value] = _make_sections(index, samples, common=c,
+                                             grouped=grouped + (field,))
         except Exception:
             msg = 'Error occurred inside grouping by field %r = %r' % (field, value)
             msg += '\nCommon: %r' % common
-            msg += '\nSamples: %s' % list(samples.keys())
+            msg += '\nSamples: %s' % [index.key(r, exclude=grouped + (field,))
+                                      for r in samples]
             logger.error(msg)
             raise
 
@@ -697,6 +1121,13 @@ def make_sections(allruns, common=None):
 def _dynreports_create_index(context, merged_data):
     rm = merged_data['report_manager']
     rm.create_index_job(context)
+    # used to merge the indices of the shards (see --shard)
+    return rm.allreports_filename
+
+
+def _dynreports_table(table):
+    """ Stores a table of the reports (see table_chunks()). """
+    return table
 
 
 def basename_from_key(key: dict) -> str:
@@ -18,12 +18,21 @@ class ResourceManager:
     def __init__(self, context):
         from quickapp.compmake_context import CompmakeContext
         assert isinstance(context, CompmakeContext), context
-        from reprep.report_utils import StoreResults
-        self.allresources = StoreResults()
+        from quickapp.rm import CompactStoreResults
+        self.allresources = CompactStoreResults()
         self.providers = defaultdict(list)  # rtype => list of providers
         self.make_prefix = {}  # rtype => function to make prefix
         self._context = context
 
+    def fork(self, context):
+        """ Returns a copy bound to another context, with the same providers
+            and the resources (promises) defined so far. """
+        rm = ResourceManager(context)
+        rm.providers.update((k, list(v)) for k, v in self.providers.items())
+        rm.make_prefix.update(self.make_prefix)
+        dict.update(rm.allresources, self.allresources)
+        return rm
+
     # @contract(rtype='str')
     def set_resource_provider(self, rtype: str, provider):
         """
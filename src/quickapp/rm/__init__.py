@@ -1,3 +1,7 @@
 from .generated_report import *
 from .create_index_dynamic import *
 from .configuration import *
+from .key_index import *
+from .shared_store import *
+from .navigation import *
+from .compact_keys import *
@@ -0,0 +1,135 @@
+import sys
+from collections.abc import Mapping
+
+from reprep.report_utils import StoreResults
+from reprep.utils import frozendict2
+
+__all__ = [
+    'CompactKey',
+    'CompactStoreResults',
+    'intern_schema',
+]
+
+# tuple of field names -> the same tuple, shared by all keys
+_schemas = {}
+
+
+def intern_schema(fields):
+    """ Returns the shared tuple of the (sorted, interned) field names. """
+    schema = tuple(sorted(sys.intern(f) for f in fields))
+    return _schemas.setdefault(schema, schema)
+
+
+def _freeze(v):
+    """ Makes a value hashable, in the same way as frozendict2. """
+    if type(v) is str:
+        return sys.intern(v)
+    if isinstance(v, dict):
+        return frozendict2(v)
+    if isinstance(v, list):
+        return tuple(frozendict2(x) if isinstance(x, dict) else x for x in v)
+    return v
+
+
+class CompactKey(Mapping):
+    """
+        An immutable key (field -> value) that stores only a tuple of values
+        and a reference to a shared schema (the sorted tuple of field names).
+
+        Field names and string values are interned. It compares equal to,
+        and has the same hash as, the frozendict2 with the same contents.
+    """
+    __slots__ = ('schema', '_values', '_hash')
+
+    def __init__(self, schema, values):
+        if len(schema) != len(values):
+            msg = 'Schema %r does not match values %r.' % (schema, values)
+            raise ValueError(msg)
+        self.schema = schema
+        self._values = values
+        self._hash = hash(tuple(zip(schema, values)))
+
+    @staticmethod
+    def from_dict(d):
+        """ Creates a CompactKey from any mapping. """
+        if isinstance(d, CompactKey):
+            return d
+        return CompactKey.from_schema(intern_schema(d.keys()), d)
+
+    @staticmethod
+    def from_schema(schema, d):
+        """ Creates a CompactKey with the given schema (from intern_schema())
+            and the values in the mapping d. """
+        values = tuple(_freeze(d[f]) for f in schema)
+        return CompactKey(schema, values)
+
+    def __getitem__(self, field):
+        try:
+            i = self.schema.index(field)
+        except ValueError:
+            raise KeyError(field)
+        return self._values[i]
+
+    def __contains__(self, field):
+        return field in self.schema
+
+    def __iter__(self):
+        return iter(self.schema)
+
+    def __len__(self):
+        return len(self.schema)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, CompactKey):
+            return (self._hash == other._hash and self.schema == other.schema
+                    and self._values == other._values)
+        return Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    def __repr__(self):
+        return 'CompactKey(%s)' % dict(zip(self.schema, self._values))
+
+    def __reduce__(self):
+        # The schema tuple and the strings are written once per pickle.
+        return _make_compact_key, (self.schema, self._values)
+
+
+def _make_compact_key(schema, values):
+    """ Used when unpickling, to intern again the schema and the strings. """
+    schema = intern_schema(schema)
+    values = tuple(sys.intern(v) if type(v) is str else v for v in values)
+    return CompactKey(schema, values)
+
+
+class CompactStoreResults(StoreResults):
+    """ A StoreResults whose keys are stored as CompactKey. """
+
+    def __getitem__(self, attrs):
+        key = self._key(attrs)
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            raise KeyError('Key %s not found.' % str(key))
+
+    def __setitem__(self, attrs, value):
+        dict.__setitem__(self, self._key(attrs), value)
+
+    def __contains__(self, attrs):
+        return dict.__contains__(self, self._key(attrs))
+
+    @staticmethod
+    def _key(attrs):
+        if isinstance(attrs, CompactKey):
+            return attrs
+        if not isinstance(attrs, Mapping):
+            msg = 'Keys to this dictionary must be dicts'
+            raise ValueError(msg)
+        return CompactKey.from_dict(attrs)
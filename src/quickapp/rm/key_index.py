@@ -0,0 +1,182 @@
+import numpy as np
+
+from zuper_commons.text import natsorted
+
+__all__ = [
+    'KeyIndex',
+    'ValueIndex',
+]
+
+
+class KeyIndex:
+    """
+        Columnar index over a collection of (key, value) pairs, where the
+        keys are dicts field -> value (for example, a StoreResults).
+
+        It is built in one pass. Each field becomes a column of integer codes
+        (-1 where the key does not have the field), and the distinct values
+        of each field are stored once. A subset of the keys is an array of
+        row numbers, so grouping by a field is a sort of the codes plus
+        array slicing, instead of a scan of all the keys.
+    """
+
+    def __init__(self, items):
+        self.keys = []
+        self.values = []
+        for k, v in items:
+            self.keys.append(k)
+            self.values.append(v)
+        n = len(self.keys)
+
+        # field -> array of codes
+        self.codes = {}
+        # field -> list of distinct values (code -> value)
+        self.field_values = {}
+        # field -> dict value -> code
+        self._value2code = {}
+
+        for i, key in enumerate(self.keys):
+            for field, value in key.items():
+                if not field in self.codes:
+                    self.codes[field] = np.full(n, -1, dtype='int64')
+                    self.field_values[field] = []
+                    self._value2code[field] = {}
+                value2code = self._value2code[field]
+                code = value2code.get(value, None)
+                if code is None:
+                    code = value2code[value] = len(value2code)
+                    self.field_values[field].append(value)
+                self.codes[field][i] = code
+
+        self.fields = sorted(self.codes)
+        # codes tuple -> row; created on demand by find()
+        self._row_of = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def all_rows(self):
+        return np.arange(len(self.keys))
+
+    def fields_in_all(self, rows, exclude=()):
+        """ Returns the fields (sorted) that are present in all the given rows. """
+        return [field for field in self.fields
+                if not field in exclude and np.all(self.codes[field][rows] >= 0)]
+
+    def num_values(self, field, rows):
+        """ Returns the number of distinct values of the field in the rows. """
+        codes = self.codes[field][rows]
+        return int(np.count_nonzero(np.bincount(codes)))
+
+    def values_of(self, field, rows=None):
+        """ Returns the distinct values of the field in the given rows
+            (all rows by default). Raises ValueError if some key does
+            not have the field. """
+        if rows is None:
+            rows = self.all_rows()
+        codes = self.codes[field][rows]
+        if np.any(codes < 0):
+            row = rows[int(np.argmin(codes))]
+            msg = 'Field %r not found in %s.' % (field, self.keys[row])
+            raise ValueError(msg)
+        distinct = np.flatnonzero(np.bincount(codes))
+        return [self.field_values[field][c] for c in distinct]
+
+    def groups(self, field, rows):
+        """
+            Partitions the rows according to the value of the field.
+
+            Returns a list of tuples (value, rows), natsorted by value.
+        """
+        codes = self.codes[field][rows]
+        if np.any(codes < 0):
+            row = rows[int(np.argmin(codes))]
+            msg = 'Could not find field %r in key %r.' % (field, self.keys[row])
+            raise ValueError(msg)
+        order = np.argsort(codes, kind='stable')
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        value2rows = {}
+        for group in np.split(order, boundaries):
+            value = self.field_values[field][codes[group[0]]]
+            value2rows[value] = rows[group]
+        return [(value, value2rows[value]) for value in natsorted(value2rows)]
+
+    def key(self, row, exclude=()):
+        """ Returns the key of the row as a dict, without the given fields. """
+        return dict((field, value) for field, value in self.keys[row].items()
+                    if not field in exclude)
+
+    def _codes_tuple(self, row):
+        return tuple(int(self.codes[field][row]) for field in self.fields)
+
+    def find(self, key):
+        """ Returns the row of the given key, or None if it is not present. """
+        if self._row_of is None:
+            self._row_of = {}
+            for row in range(len(self.keys)):
+                self._row_of[self._codes_tuple(row)] = row
+        codes = []
+        for field in self.fields:
+            if field in key:
+                code = self._value2code[field].get(key[field], None)
+                if code is None:
+                    return None
+            else:
+                code = -1
+            codes.append(code)
+        if len(key) != sum(1 for c in codes if c >= 0):
+            # the key has fields that no indexed key has
+            return None
+        return self._row_of.get(tuple(codes), None)
+
+    def variation(self, row, field, value):
+        """ Returns the row of the key obtained by changing only the given field
+            of the key in the given row, or None if it is not present. """
+        code = self._value2code[field].get(value, None)
+        if code is None:
+            return None
+        if self._row_of is None:
+            self.find({})
+        codes = list(self._codes_tuple(row))
+        codes[self.fields.index(field)] = code
+        return self._row_of.get(tuple(codes), None)
+
+
+class ValueIndex:
+    """
+        Inverted index from the values of the keys to the keys that
+        contain them (regardless of the field).
+
+        Used to find the key that shares the most values with a given key,
+        looking only at the keys that share at least one value.
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        postings = {}
+        for row, key in enumerate(self.keys):
+            for value in set(key.values()):
+                postings.setdefault(value, []).append(row)
+        # value -> array of rows
+        self.postings = dict((value, np.array(rows, dtype='int64'))
+                             for value, rows in postings.items())
+
+    def most_similar(self, key):
+        """
+            Returns the key that has the largest number of values
+            in common with the given key, or None if there is a tie.
+        """
+        n = len(self.keys)
+        if n == 0:
+            msg = 'No keys in the index.'
+            raise ValueError(msg)
+        hits = [self.postings[value] for value in set(key.values())
+                if value in self.postings]
+        if not hits:
+            # all scores are 0
+            return self.keys[0] if n == 1 else None
+        rows, scores = np.unique(np.concatenate(hits), return_counts=True)
+        best = np.flatnonzero(scores == scores.max())
+        if len(best) > 1:
+            return None
+        return self.keys[int(rows[best[0]])]
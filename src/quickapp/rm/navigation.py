@@ -0,0 +1,162 @@
+import json
+import os
+
+from zuper_commons.text import natsorted
+
+from .key_index import KeyIndex
+
+__all__ = [
+    'navigation_data',
+    'write_navigation_sidecar',
+    'create_links_html_sidecar',
+]
+
+# Name of the global variable defined by the sidecar file.
+NAVIGATION_VAR = 'quickapp_navigation'
+
+# Same as in create_links_html()
+MAX_VARIATIONS_EXPLICIT = 10
+
+
+def navigation_data(reports, dirname, index_filename):
+    """
+        Returns the navigation data for the reports of one type,
+        as a JSON-serializable dict:
+
+            fields:  list of the field names
+            values:  field -> list of the values (as strings, natsorted)
+            reports: list of [i_1, ..., i_n, link], where i_k is the position
+                     of the value of field k in values, and link is the
+                     filename of the report relative to dirname
+            index:   the index filename, relative to dirname
+
+        :param reports: StoreResults key (without 'report') -> filename
+    """
+    index = KeyIndex(reports.items())
+    values = {}
+    positions = {}
+    for field in index.fields:
+        field_values = natsorted(index.values_of(field))
+        values[field] = [str(v) for v in field_values]
+        positions[field] = dict((v, i) for i, v in enumerate(field_values))
+
+    rows = []
+    for row in index.all_rows():
+        key = index.keys[row]
+        r = [positions[field][key[field]] for field in index.fields]
+        r.append(os.path.relpath(index.values[row], dirname))
+        rows.append(r)
+
+    return dict(fields=index.fields, values=values, reports=rows,
+                index=os.path.relpath(index_filename, dirname))
+
+
+def write_navigation_sidecar(reports, sidecar, index_filename):
+    """
+        Writes the navigation data for the reports of one type.
+
+        The data is wrapped as a script that defines a global variable,
+        so that the pages can load it with a <script> tag also when they
+        are opened from the filesystem.
+    """
+    data = navigation_data(reports, os.path.dirname(sidecar), index_filename)
+    s = 'var %s = %s;\n' % (NAVIGATION_VAR,
+                            json.dumps(data, sort_keys=True, separators=(',', ':')))
+    dirname = os.path.dirname(sidecar)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(sidecar, 'w') as f:
+        f.write(s)
+    return sidecar
+
+
+def create_links_html_sidecar(this_report, report_html, sidecar,
+                              most_similar_other_type):
+    """
+        Returns the html for the navigation links of a report, which are
+        rendered in the browser from the sidecar file. Unlike
+        create_links_html(), it does not depend on the other reports of
+        the same type.
+
+        :param this_report: dictionary with the keys describing the report
+        :param sidecar: filename of the navigation sidecar for this type
+    """
+    dirname = os.path.dirname(report_html)
+
+    this = dict((k, str(v)) for k, v in this_report.items())
+    s = "<div id='quickapp-navigation'></div>\n"
+    s += "<script src='%s'></script>\n" % os.path.relpath(sidecar, dirname)
+    s += "<script>\n"
+    s += NAVIGATION_JS % dict(var=NAVIGATION_VAR,
+                              this=json.dumps(this, sort_keys=True),
+                              max_explicit=MAX_VARIATIONS_EXPLICIT)
+    s += "</script>\n"
+
+    if most_similar_other_type:
+        s += '<p>Other report: '
+        for other_type, _, filename in most_similar_other_type:
+            s += '<a href="%s">%s</a> ' % (os.path.relpath(filename, dirname), other_type)
+        s += '</p>'
+
+    s = '<div style="margin-left: 1em;">' + s + '</div>'
+    return s
+
+
+# Renders the same table as create_links_html().
+NAVIGATION_JS = """
+(function () {
+    var nav = window.%(var)s;
+    var me = %(this)s;
+    var div = document.getElementById('quickapp-navigation');
+    if (!nav || !div) {
+        return;
+    }
+    var fields = nav.fields;
+    var link_of = {};
+    nav.reports.forEach(function (r) {
+        link_of[r.slice(0, fields.length).join(',')] = r[fields.length];
+    });
+    var mine = fields.map(function (f) {
+        return nav.values[f].indexOf(me[f]);
+    });
+    var s = "<p><a href='" + nav.index + "'>All report</a></p>";
+    s += "<table class='variations'><thead><tr>";
+    fields.forEach(function (f) {
+        s += '<th>' + f + '</th>';
+    });
+    s += '</tr></thead><tr>';
+    fields.forEach(function (f, k) {
+        var values = nav.values[f];
+        var variations = values.map(function (v, i) {
+            if (i === mine[k]) {
+                return [v, null];
+            }
+            var codes = mine.slice();
+            codes[k] = i;
+            var link = link_of[codes.join(',')];
+            return link === undefined ? [v + ' (n/a)', null] : [v, link];
+        });
+        s += '<td>';
+        if (variations.length > %(max_explicit)s) {
+            s += "<select onchange='if (this.value) { window.location = this.value; }'>";
+            variations.forEach(function (x) {
+                var selected = x[0] === me[f] ? ' selected' : '';
+                s += "<option value='" + (x[1] || '') + "'" + selected + '>' + x[0] + '</option>';
+            });
+            s += '</select>';
+        } else {
+            variations.forEach(function (x) {
+                if (x[1] !== null) {
+                    s += "<a href='" + x[1] + "'> " + x[0] + '</a> ';
+                } else {
+                    s += x[0] + ' ';
+                }
+                s += '<br/>';
+            });
+        }
+        s += '</td>';
+    });
+    s += '</tr></table>';
+    div.innerHTML = s;
+})();
+"""
@@ -0,0 +1,39 @@
+import hashlib
+import pickle
+from weakref import WeakKeyDictionary
+
+from compmake.context import load_static_storage
+
+__all__ = [
+    'comp_store_shared',
+]
+
+# compmake Context -> dict (job prefix, digest) -> Promise
+_books = WeakKeyDictionary()
+
+
+def comp_store_shared(context, x, name='shared'):
+    """
+        Stores a (large) object once, as a job that just returns it,
+        and returns the Promise of that job.
+
+        The job is identified by the hash of the pickled object, so storing
+        the same content twice (from the same context and job prefix)
+        gives back the same Promise; jobs that take the Promise as an
+        argument keep only a reference to it in their definition, and
+        compmake loads the object from the DB when they run.
+
+        :param context: a compmake Context or a QuickAppContext.
+        :param name: used in the job id, together with the hash.
+    """
+    cc = getattr(context, 'cc', context)
+    prefix = context.get_comp_prefix()
+    data = pickle.dumps(x, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha1(data).hexdigest()
+
+    book = _books.setdefault(cc, {})
+    k = (prefix, digest)
+    if not k in book:
+        job_id = 'dynreports-store-%s-%s' % (name, digest[:16])
+        book[k] = context.comp(load_static_storage, x, job_id=job_id)
+    return book[k]
@@ -0,0 +1,72 @@
+import hashlib
+import os
+
+from compmake import StorageFilesystem
+from compmake.jobs.storage import get_job_userobject, job_userobject_exists
+
+from .report_manager import index_reports
+from .rm import CompactStoreResults
+
+__all__ = [
+    'parse_shard',
+    'in_shard',
+    'merge_shards',
+]
+
+# Job id of the index job of each shard; its result is the map from
+# the report keys to the files.
+SHARD_INDEX_JOB_ID = 'dynreports-shard-index'
+
+
+def parse_shard(s: str):
+    """ Parses a string "i/N" into the tuple (i, N), with 0 <= i < N. """
+    try:
+        i, n = [int(x) for x in s.split('/')]
+    except ValueError:
+        msg = 'Invalid shard %r; expected "i/N".' % s
+        raise ValueError(msg)
+    if not 0 <= i < n:
+        msg = 'Invalid shard %r; need 0 <= i < N.' % s
+        raise ValueError(msg)
+    return i, n
+
+
+def in_shard(key: str, shard) -> bool:
+    """ Returns True if the key belongs to the shard (i, N); the
+        assignment depends only on the key, not on the process. """
+    i, n = shard
+    h = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return int(h[:15], 16) % n == i
+
+
+def shard_storage(output_dir, shard):
+    """ Returns the compmake DB directory of the shard (i, N). """
+    return os.path.join(output_dir, 'compmake-shard-%d-of-%d' % shard)
+
+
+def shard_index(output_dir, shard):
+    """ Returns the index file written by the shard (i, N). """
+    return os.path.join(output_dir, 'report-shard-%d-of-%d.html' % shard)
+
+
+def merge_shards(output_dir, n, compress=False):
+    """
+        Writes the global index of the reports (report.html in
+        output_dir) from the results of the index jobs in the DBs
+        of the N shards.
+
+        Returns the number of reports.
+    """
+    allreports_filename = CompactStoreResults()
+    missing = []
+    for i in range(n):
+        db = StorageFilesystem(shard_storage(output_dir, (i, n)), compress=compress)
+        if not job_userobject_exists(SHARD_INDEX_JOB_ID, db):
+            missing.append(i)
+            continue
+        dict.update(allreports_filename, get_job_userobject(SHARD_INDEX_JOB_ID, db))
+    if missing:
+        msg = 'The index jobs of these shards are not done: %s' % missing
+        raise ValueError(msg)
+    index_reports(allreports_filename, os.path.join(output_dir, 'report.html'))
+    return len(allreports_filename)
@@ -0,0 +1,66 @@
+import os
+
+from compmake.jobs.storage import get_job_userobject
+from nose.tools import istest
+from reprep import Report
+from reprep.report_utils import StoreResults
+
+from quickapp import QuickApp
+
+from .quickappbase import QuickappTest
+
+
+def square(x, offset=0):
+    return x * x + offset
+
+
+def total(values):
+    return sum(values)
+
+
+def report_value(x):
+    r = Report()
+    r.text('x', '%s' % x)
+    return r
+
+
+class QuickAppDemoCompMap(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        xs = list(range(7))
+        squares = context.comp_map(square, xs, job_id_fn=lambda x: 'sq%d' % x)
+        context.comp(total, squares, job_id='total')
+
+        chunked = context.comp_map(square, xs, chunk_size=3, offset=1,
+                                   job_id_fn=lambda x: 'sqc%d' % x)
+        context.comp(total, chunked, job_id='total_chunked')
+        context.comp(square, chunked[4], job_id='single_chunked')
+        context.add_report(context.comp_map(report_value, [5], chunk_size=2)[0], 'value')
+
+        inputs = StoreResults()
+        for x in xs:
+            inputs[dict(x=x)] = x
+        res = context.comp_map(square, inputs, job_id_fn=lambda k: 'sqs%d' % k['x'])
+        assert isinstance(res, StoreResults)
+        context.comp(total, list(res.values()), job_id='total_store')
+
+
+@istest
+class TestCompMap(QuickappTest):
+
+    def test_comp_map(self):
+        self.run_quickapp(QuickAppDemoCompMap, cmd='make recurse=1')
+        jobs = self.get_jobs('all')
+        self.assertIn('sq6', jobs)
+        self.assertIn('sqc0-chunk', jobs)
+        self.assertIn('sqc6-chunk', jobs)
+        self.assertNotIn('sqc1', jobs)
+        expected = sum(x * x for x in range(7))
+        self.assertEqual(get_job_userobject('total', self.db), expected)
+        self.assertEqual(get_job_userobject('total_chunked', self.db), expected + 7)
+        self.assertEqual(get_job_userobject('single_chunked', self.db), (4 * 4 + 1) ** 2)
+        self.assertEqual(get_job_userobject('total_store', self.db), expected)
+        self.assertTrue(os.path.exists(os.path.join(self.root0, 'report', 'value', 'value.html')))
@@ -0,0 +1,94 @@
+from compmake.jobs.storage import get_job_userobject
+from nose.tools import istest
+from reprep import Report
+
+from quickapp import QuickApp
+
+from .quickappbase import QuickappTest
+
+
+def square(x):
+    return x * x
+
+
+def total(values):
+    return sum(values)
+
+
+def report_value(x):
+    r = Report()
+    r.text('x', '%s' % x)
+    return r
+
+
+def define_small(context):
+    squares = [context.comp_small(square, x) for x in range(10)]
+    return context.comp(total, squares, job_id='total')
+
+
+class QuickAppDemoCompSmall(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.set_small_chunk_size(4)
+        define_small(context)
+        context.comp(square, context.comp_small(square, 3), job_id='single')
+        context.add_report(context.comp_small(report_value, 5), 'value')
+        context.comp_dynamic(define_small_dynamic, job_id='dyn')
+        # left in the buffer until the end of define_jobs_context()
+        context.comp_small(square, 7, job_id='last')
+
+
+def define_small_dynamic(context):
+    squares = [context.comp_small(square, x) for x in range(3)]
+    return context.comp(total, squares, job_id='total_dyn')
+
+
+def provide_square(context, x):
+    return context.comp_small(square, x)
+
+
+class QuickAppDemoSmallExtraDep(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.comp_map(square, [1, 2], extra_dep=[context.comp_small(square, 1)])
+        c = context.child('c', extra_dep=[context.comp_small(square, 2)])
+        c.comp(square, 3, job_id='in_child')
+        rm = context.get_resource_manager()
+        rm.set_resource_provider('square', provide_square)
+        context.needs('square', x=4)
+        context.comp(square, 5, job_id='after_needs')
+
+
+@istest
+class TestCompSmall(QuickappTest):
+
+    def test_comp_small(self):
+        self.run_quickapp(QuickAppDemoCompSmall, cmd='make recurse=1')
+        jobs = self.get_jobs('all')
+        chunks = [j for j in jobs if 'square_small' in j]
+        # 10 calls in chunks of 4, then 1 (flushed by 'single'),
+        # then 1 (left at the end)
+        self.assertEqual(len(chunks), 5 + 1, chunks)
+        self.assertNotIn('last', jobs)
+        self.assertEqual(get_job_userobject('total', self.db), sum(x * x for x in range(10)))
+        self.assertEqual(get_job_userobject('single', self.db), 81)
+        self.assertEqual(get_job_userobject('total_dyn', self.db), 5)
+
+
+    def test_comp_small_rerun(self):
+        self.run_quickapp(QuickAppDemoCompSmall, cmd='make recurse=1')
+        jobs1 = sorted(self.get_jobs('all'))
+        self.run_quickapp(QuickAppDemoCompSmall, cmd='make recurse=1')
+        self.assertEqual(jobs1, sorted(self.get_jobs('all')))
+
+    def test_comp_small_extra_dep(self):
+        # the chunk jobs are defined before the jobs that depend on them
+        self.run_quickapp(QuickAppDemoSmallExtraDep, cmd='make recurse=1')
+        self.assertEqual(get_job_userobject('c-in_child', self.db), 9)
+        self.assertEqual(get_job_userobject('after_needs', self.db), 25)
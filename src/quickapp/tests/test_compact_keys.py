@@ -0,0 +1,47 @@
+import pickle
+import unittest
+
+from reprep.report_utils import StoreResults
+from reprep.utils import frozendict2
+
+from quickapp.rm import CompactKey, CompactStoreResults, intern_schema
+
+
+class TestCompactKey(unittest.TestCase):
+
+    def test_same_as_frozendict(self):
+        d = dict(report='r', param1='a', param2=2)
+        k = CompactKey.from_dict(d)
+        f = frozendict2(**d)
+        self.assertEqual(k, f)
+        self.assertEqual(f, k)
+        self.assertEqual(hash(k), hash(f))
+        self.assertEqual(dict(**k), d)
+        self.assertEqual(k['param2'], 2)
+        self.assertFalse(k != f)
+        self.assertNotEqual(k, frozendict2(report='r', param1='a', param2=3))
+
+    def test_shared_schema(self):
+        k1 = CompactKey.from_dict(dict(b=1, a='x'))
+        k2 = CompactKey.from_dict(dict(a='y', b=2))
+        self.assertIs(k1.schema, k2.schema)
+        self.assertIs(k1.schema, intern_schema(['a', 'b']))
+
+    def test_pickle(self):
+        k = CompactKey.from_dict(dict(a='x', b=[1, 2]))
+        k2 = pickle.loads(pickle.dumps(k))
+        self.assertEqual(k, k2)
+        self.assertIs(k2.schema, k.schema)
+
+    def test_store_results(self):
+        res = CompactStoreResults()
+        old = StoreResults()
+        for i in range(100):
+            d = dict(report='report_example', param1='value%d' % (i % 10), param2=i)
+            res[d] = 'file%d.html' % i
+            old[d] = 'file%d.html' % i
+        self.assertEqual(res[dict(report='report_example', param1='value3', param2=3)],
+                         'file3.html')
+        self.assertIn(frozendict2(report='report_example', param1='value3', param2=13), res)
+        self.assertEqual(len(res.select(param1='value1')), 10)
+        self.assertLess(len(pickle.dumps(res)), len(pickle.dumps(old)))
@@ -0,0 +1,73 @@
+import gc
+import weakref
+
+from nose.tools import istest
+
+from quickapp import QuickAppContext
+from quickapp.app_utils import (iterate_context_names, iterate_context_names_triplet,
+                                iterate_context_product)
+
+from .quickappbase import QuickappTest
+
+
+def nested_triplet(context, it1, it2, it3, key1=None, key2=None, key3=None):
+    """ The previous implementation of iterate_context_names_triplet(). """
+    for c1, x1 in iterate_context_names(context, it1, key=key1):
+        for c2, x2 in iterate_context_names(c1, it2, key=key2):
+            for c3, x3 in iterate_context_names(c2, it3, key=key3):
+                yield c3, x1, x2, x3
+
+
+def describe(cells):
+    return [(c.get_comp_prefix(), dict(c.extra_report_keys)) + tuple(values)
+            for c, *values in cells]
+
+
+@istest
+class TestContextProduct(QuickappTest):
+
+    def new_context(self):
+        return QuickAppContext(cc=self.cc, qapp=None, parent=None, job_prefix=None,
+                               output_dir=self.root0)
+
+    def test_same_as_nested(self):
+        axes = (['a_1', 'a_2'], ['b1', 'b2', 'b3'], [10, 20])
+        expected = describe(nested_triplet(self.new_context(), *axes, key1='a', key3='c'))
+        self.assertEqual(expected, describe(
+            iterate_context_names_triplet(self.new_context(), *axes, key1='a', key3='c')))
+        self.assertEqual(expected, describe(
+            iterate_context_product(self.new_context(), report_keys=dict(a='a', c='c'),
+                                    a=axes[0], b=axes[1], c=axes[2])))
+
+    def test_order_and_shards(self):
+        axes = dict(x=range(4), y=range(3), z=range(2))
+        expected = describe(iterate_context_product(self.new_context(), report_keys=True, **axes))
+        self.assertEqual(len(expected), 24)
+        shuffled = describe(iterate_context_product(self.new_context(), report_keys=True,
+                                                    order='shuffle', seed=1, **axes))
+        self.assertNotEqual(shuffled, expected)
+        self.assertEqual(sorted(shuffled), sorted(expected))
+
+        for order in [None, 'shuffle']:
+            shards = [describe(iterate_context_product(self.new_context(), report_keys=True,
+                                                       order=order, shard=(i, 5), **axes))
+                      for i in range(5)]
+            self.assertEqual(sorted(sum(shards, [])), sorted(expected))
+
+    def test_invalid(self):
+        root = self.new_context()
+        self.assertRaises(ValueError, list, iterate_context_product(root, x=[]))
+        self.assertRaises(ValueError, list, iterate_context_product(root, order='random', x=[1]))
+        self.assertRaises(ValueError, list, iterate_context_product(root, shard=(2, 2), x=[1]))
+        self.assertRaises(ValueError, iterate_context_product, root, report_keys=dict(y='y'), x=[1])
+
+    def test_leaves_not_kept(self):
+        root = self.new_context()
+        leaves = []
+        for c, x, y in iterate_context_product(root, x=range(3), y=range(4)):
+            c.comp(int, job_id='job')
+            leaves.append(weakref.ref(c))
+        del c
+        gc.collect()
+        self.assertEqual([r() for r in leaves], [None] * 12)
+        self.assertEqual(root.n_comp_invocations, 12)
@@ -0,0 +1,47 @@
+from compmake.jobs.storage import get_job_userobject
+from nose.tools import istest
+
+from quickapp import QuickApp, quickapp_main
+
+from .quickappbase import QuickappTest
+
+
+def f(x):
+    return x + 1
+
+
+class QuickAppDemoDefineCache(QuickApp):
+    ndefined = 0
+
+    def define_options(self, params):
+        params.add_int('n', default=3)
+
+    def define_jobs_context(self, context):
+        QuickAppDemoDefineCache.ndefined += 1
+        n = self.get_options().n
+        values = [context.comp(f, i) for i in range(n)]
+        context.comp(sum, values, job_id='total')
+
+
+@istest
+class TestDefineCache(QuickappTest):
+
+    def run_app(self, *extra):
+        args = ['-o', self.root0, '-c', 'make', '--compress', '--define_cache'] + list(extra)
+        self.assertEqual(0, quickapp_main(QuickAppDemoDefineCache, args, sys_exit=False))
+
+    def test_define_cache(self):
+        QuickAppDemoDefineCache.ndefined = 0
+        self.run_app()
+        self.assertEqual(QuickAppDemoDefineCache.ndefined, 1)
+        self.assertEqual(get_job_userobject('total', self.db), 6)
+        # same options: the jobs are not defined again
+        self.run_app()
+        self.assertEqual(QuickAppDemoDefineCache.ndefined, 1)
+        # explicit redefinition
+        self.run_app('--redefine')
+        self.assertEqual(QuickAppDemoDefineCache.ndefined, 2)
+        # different options
+        self.run_app('--n', '4')
+        self.assertEqual(QuickAppDemoDefineCache.ndefined, 3)
+        self.assertEqual(get_job_userobject('total', self.db), 10)
@@ -0,0 +1,58 @@
+from compmake.jobs.storage import get_job_userobject
+from nose.tools import istest
+from reprep import Report
+
+from quickapp import QuickApp, quickapp_main
+
+from .quickappbase import QuickappTest
+
+
+def scan(n):
+    """ The expensive part of the definition. """
+    return list(range(n))
+
+
+def make_report(values):
+    r = Report()
+    r.text('values', '%s' % values)
+    return r
+
+
+def define_child(context, values):
+    total = context.comp(sum, values, job_id='total')
+    context.add_report(context.comp(make_report, values), 'values', n=len(values))
+    return total
+
+
+class QuickAppDemoDefineParallel(QuickApp):
+
+    def define_options(self, params):
+        params.add_string('executor', default='thread')
+        params.add_int('workers', default=3)
+
+    def define_jobs_context(self, context):
+        options = self.get_options()
+        children = [('c%d' % n, dict(n=n)) for n in range(5)]
+        totals = context.define_children_parallel(children, scan, define_child,
+                                                  workers=options.workers,
+                                                  executor=options.executor)
+        context.comp(sum, totals, job_id='total')
+
+
+@istest
+class TestDefineParallel(QuickappTest):
+
+    def run_app(self, *extra):
+        args = ['-o', self.root0, '-c', 'make recurse=1', '--compress'] + list(extra)
+        self.assertEqual(0, quickapp_main(QuickAppDemoDefineParallel, args, sys_exit=False))
+        jobs = self.get_jobs('all')
+        for n in range(5):
+            self.assertIn('c%d-total' % n, jobs)
+        self.assertEqual(get_job_userobject('total', self.db),
+                         sum(sum(range(n)) for n in range(5)))
+        return sorted(jobs)
+
+    def test_define_parallel(self):
+        sequential = self.run_app('--workers', '1')
+        self.assertEqual(sequential, self.run_app('--executor', 'thread'))
+        self.assertEqual(sequential, self.run_app('--executor', 'process'))
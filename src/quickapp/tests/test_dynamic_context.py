@@ -0,0 +1,160 @@
+import os
+
+from compmake.jobs.storage import get_job_userobject, get_job_args, get_job
+from nose.tools import istest
+from reprep import Report
+
+from quickapp import QuickApp
+
+from .quickappbase import QuickappTest
+
+
+def make_report(i):
+    r = Report()
+    r.text('i', '%s' % i)
+    return r
+
+
+def define_more(context):
+    context.add_report(context.comp(make_report, 'dyn'), 'dyn')
+
+
+def define_from_static(context):
+    # a report added before the branch
+    r = context.get_report('static', i=0)
+    context.add_report(context.comp(copy_report, r), 'copy')
+
+
+def copy_report(r):
+    return r
+
+
+def define_value(context, x):
+    return context.comp(double, x, job_id='double')
+
+
+def double(x):
+    return 2 * x
+
+
+def define_inner(context, x):
+    return context.comp(double, x)
+
+
+def define_outer(context, x):
+    # returns the promise of another dynamic job
+    return context.comp_dynamic(define_inner, x)
+
+
+def identity(x):
+    return x
+
+
+class QuickAppDemoSlimContext(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        for i in range(20):
+            context.add_report(context.comp(make_report, i), 'static', i=i)
+        context.comp_dynamic(define_more, job_id='more')
+        assert context.dynamic_context_size > 0
+
+
+class QuickAppDemoGetReport(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        for i in range(3):
+            context.add_report(context.comp(make_report, i), 'static', i=i)
+        context.comp_dynamic(define_from_static, job_id='from_static')
+
+
+class QuickAppDemoFusedDynamic(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        values = []
+        for i in range(3):
+            c = context.child('c%d' % i)
+            values.append(c.comp_dynamic(define_value, i, job_id='value'))
+        context.comp(sum, values, job_id='total')
+
+
+class QuickAppDemoNestedDynamic(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.comp(identity, context.comp_dynamic(define_outer, 5), job_id='nested')
+
+
+class QuickAppDemoReportTables(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        # a sweep: each cell adds a report and branches
+        for i in range(64):
+            c = context.child('c%d' % i)
+            c.add_report(c.comp(make_report, i), 'cell', i=i)
+            c.comp_dynamic(define_more, job_id='more')
+            assert c.dynamic_context_size > 0
+
+
+@istest
+class TestSlimContext(QuickappTest):
+
+    def test_slim_context(self):
+        self.run_quickapp(QuickAppDemoSlimContext, cmd='make recurse=1')
+        qc = get_job_userobject('context', self.db)
+        self.assertEqual(len(qc.get_report_manager().allreports), 0)
+        self.assertEqual(len(qc.all_jobs_dict()), 0)
+        self.assertEqual(qc.branched_contexts, [])
+        self.assertIsNone(qc._parent)
+        self.assertTrue(os.path.exists(os.path.join(self.root0, 'report', 'dyn', 'dyn.html')))
+        self.assertTrue(os.path.exists(os.path.join(self.root0, 'report', 'static', 'static-0.html')))
+
+    def test_get_report(self):
+        self.run_quickapp(QuickAppDemoGetReport, cmd='make recurse=1')
+        self.assertTrue(os.path.exists(os.path.join(self.root0, 'report', 'copy', 'copy.html')))
+        # only the new report is merged back
+        data = get_job_userobject('from_static-dynreports-merge', self.db)
+        self.assertEqual(len(data['report_manager'].allreports), 1)
+        with open(os.path.join(self.root0, 'report.html')) as f:
+            self.assertEqual(f.read().count('<a href='), 4 + 4)
+
+    def test_fused_dynamic(self):
+        self.run_quickapp(QuickAppDemoFusedDynamic, cmd='make recurse=1')
+        jobs = self.get_jobs('all')
+        # for each branch: the context, the dynamic job and the job it
+        # defines; no jobs to split the result, and nothing to merge
+        for i in range(3):
+            self.assertEqual(sorted(j for j in jobs if j.startswith('c%d-' % i)),
+                             ['c%d-context' % i, 'c%d-double' % i, 'c%d-value' % i])
+        # plus the total, the merge of the branches and the index
+        self.assertEqual(len(jobs), 3 * 3 + 3)
+        self.assertEqual(get_job_userobject('total', self.db), 2 * (0 + 1 + 2))
+
+    def test_nested_dynamic(self):
+        self.run_quickapp(QuickAppDemoNestedDynamic, cmd='make recurse=1')
+        self.assertEqual(get_job_userobject('nested', self.db), 10)
+
+    def test_report_tables(self):
+        self.run_quickapp(QuickAppDemoReportTables, cmd='ls')
+        tables = [get_job_args(j, self.db)[1][0] for j in self.get_jobs('all')
+                  if get_job(j, self.db).command_desc == '_dynreports_table']
+        # each of the 64 reports is stored at most log2(64) + 1 times,
+        # not once for each of the cells that follow it
+        self.assertEqual(sum(map(len, tables)), 64 * 7)
+        # and each cell references at most log2(64) + 1 tables
+        for i in range(64):
+            args = get_job_args('c%d-more' % i, self.db)[2]
+            self.assertLessEqual(len(args['reports']), 7)
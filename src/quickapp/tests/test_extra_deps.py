@@ -0,0 +1,92 @@
+import unittest
+
+from compmake import Promise
+from compmake.jobs.queries import direct_children
+from nose.tools import istest
+
+from quickapp import QuickApp, iterate_context_names
+from quickapp.extra_deps import ExtraDeps
+
+from .quickappbase import QuickappTest
+
+
+def ids(promises):
+    return [p.job_id for p in promises]
+
+
+class TestExtraDeps(unittest.TestCase):
+
+    def test_dedup(self):
+        a, b = Promise('a'), Promise('b')
+        e = ExtraDeps.from_list([a, b, Promise('a')])
+        self.assertEqual(ids(e.as_list()), ['a', 'b'])
+        self.assertIs(e.extend([Promise('b')]), e)
+        self.assertEqual(ids(e.with_extra([Promise('c'), Promise('a')])), ['a', 'b', 'c'])
+
+    def test_shared(self):
+        e = ExtraDeps.from_list([Promise('a')])
+        e1 = e.extend([Promise('b')])
+        e2 = e.extend([Promise('c')])
+        self.assertIs(e1.parent, e2.parent)
+        self.assertEqual(ids(e.as_list()), ['a'])
+        self.assertEqual(ids(e1.as_list()), ['a', 'b'])
+        self.assertEqual(ids(e2.as_list()), ['a', 'c'])
+
+    def test_checkpoints(self):
+        e = ExtraDeps.from_list([Promise('a')])
+        for i in range(10):
+            e = e.extend([Promise('x%d' % i)])
+            e = e.extend([Promise('check%d' % i)], covers_ancestors=True)
+        self.assertEqual(ids(e.as_list()), ['check9'])
+        e = e.extend([Promise('y')])
+        self.assertEqual(ids(e.as_list()), ['check9', 'y'])
+
+
+def g(i):
+    return i
+
+
+class QuickAppDemoBarrier(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        prereqs = [context.comp(g, i, job_id='pre%d' % i) for i in range(10)]
+        c = context.child('c', extra_dep=prereqs)
+        for i in range(5):
+            c.comp(g, i, job_id='job%d' % i)
+
+
+class QuickAppDemoBarrierGrid(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        prereqs = [context.comp(g, i, job_id='pre%d' % i) for i in range(20)]
+        grid = context.child('grid', extra_dep=prereqs)
+        for c, i in iterate_context_names(grid, list(range(50))):
+            c.comp(g, i, job_id='job')
+
+
+@istest
+class TestBarrier(QuickappTest):
+
+    def test_barrier(self):
+        self.run_quickapp(QuickAppDemoBarrier, cmd='make')
+        barriers = [j for j in self.get_jobs('all') if 'dynreports-barrier' in j]
+        self.assertEqual(len(barriers), 1)
+        self.assertEqual(len(direct_children(barriers[0], self.db)), 10)
+        for i in range(5):
+            self.assertEqual(set(direct_children('c-job%d' % i, self.db)), set(barriers))
+            self.assert_job_uptodate('c-job%d' % i, True)
+
+    def test_barrier_grid(self):
+        self.run_quickapp(QuickAppDemoBarrierGrid, cmd='ls')
+        jobs = self.get_jobs('all')
+        barriers = [j for j in jobs if 'dynreports-barrier' in j]
+        # one barrier shared by all the children
+        self.assertEqual(len(barriers), 1)
+        nedges = sum(len(direct_children(j, self.db)) for j in jobs)
+        self.assertEqual(nedges, 20 + 50)
@@ -0,0 +1,32 @@
+import unittest
+
+from compmake import Promise
+
+from quickapp.job_registry import JobRegistry
+
+
+class TestJobRegistry(unittest.TestCase):
+
+    def test_linked(self):
+        root = JobRegistry()
+        root.add(Promise('a'))
+        child = JobRegistry()
+        child.add(Promise('b'))
+        root.link(child)
+        root.link(child)
+        grandchild = JobRegistry()
+        child.link(grandchild)
+        # added after linking
+        grandchild.add(Promise('c'))
+        self.assertEqual(sorted(root.all_jobs()), ['a', 'b', 'c'])
+        self.assertEqual(sorted(child.all_jobs()), ['b', 'c'])
+        self.assertEqual(len(root), 3)
+
+    def test_shared(self):
+        shared = JobRegistry()
+        shared.add(Promise('s'))
+        a, b = JobRegistry(), JobRegistry()
+        a.link(shared)
+        b.link(shared)
+        a.link(b)
+        self.assertEqual(sorted(a.all_jobs()), ['s'])
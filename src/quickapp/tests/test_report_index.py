@@ -0,0 +1,132 @@
+import os
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+
+from quickapp.report_manager import (create_links_html_table, get_mtimes,
+                                     make_sections, order_statistics, sort_by_type)
+from quickapp.rm import KeyIndex, ValueIndex
+
+
+class TestOrderStatistics(unittest.TestCase):
+
+    def test_order_statistics_brute_force(self):
+        times = np.array([5.0, 1.0, 3.0, 3.0, 7.0, 1.0])
+        expected = [np.mean(times < t) for t in times]
+        self.assertEqual(list(order_statistics(times)), expected)
+
+    def test_order_statistics_empty(self):
+        self.assertEqual(len(order_statistics([])), 0)
+
+    def test_get_mtimes(self):
+        d = mkdtemp()
+        exists = os.path.join(d, 'a.html')
+        with open(exists, 'w') as f:
+            f.write('a')
+        missing = os.path.join(d, 'b.html')
+        res = get_mtimes([exists, missing])
+        self.assertEqual(list(res), [exists])
+        self.assertEqual(res[exists], os.path.getmtime(exists))
+
+
+def make_sections_reference(allruns, common=None):
+    """ The previous implementation, based on StoreResults. """
+    if common is None:
+        common = {}
+    if len(allruns) == 1:
+        key = list(allruns.keys())[0]
+        return dict(type='sample', common=common, key=key, value=allruns[key])
+    fields_size = [(field, len(list(allruns.groups_by_field_value(field))))
+                   for field in allruns.field_names_in_all_keys()]
+    fields_size.sort(key=lambda x: x[1])
+    field = fields_size[0][0]
+    division = {}
+    for value, samples in allruns.groups_by_field_value(field):
+        c = dict(common)
+        c[field] = value
+        division[value] = make_sections_reference(samples.remove_field(field), common=c)
+    return dict(type='division', field=field, division=division, common=common)
+
+
+def example_reports():
+    from reprep.report_utils import StoreResults
+    res = StoreResults()
+    for report in ['r1', 'r2']:
+        for i in range(3):
+            for c in ['a', 'b', 'c', 'd']:
+                if report == 'r2' and c in ['c', 'd']:
+                    continue
+                res[dict(report=report, i=i, c=c)] = '%s-%s-%s.html' % (report, i, c)
+    return res
+
+
+class TestKeyIndex(unittest.TestCase):
+
+    def test_groups(self):
+        reports = example_reports()
+        index = KeyIndex(reports.items())
+        self.assertEqual(index.fields, ['c', 'i', 'report'])
+        groups = index.groups('report', index.all_rows())
+        self.assertEqual([v for v, _ in groups], ['r1', 'r2'])
+        self.assertEqual([len(rows) for _, rows in groups], [12, 6])
+        self.assertEqual(index.num_values('c', groups[1][1]), 2)
+
+    def test_find_and_variation(self):
+        reports = example_reports()
+        index = KeyIndex(reports.items())
+        row = index.find(dict(report='r2', i=1, c='b'))
+        self.assertEqual(index.values[row], 'r2-1-b.html')
+        self.assertIsNone(index.find(dict(report='r2', i=1, c='d')))
+        self.assertIsNone(index.find(dict(report='r2', i=1)))
+        other = index.variation(row, 'i', 2)
+        self.assertEqual(index.values[other], 'r2-2-b.html')
+        self.assertIsNone(index.variation(row, 'c', 'c'))
+
+    def test_make_sections_same_as_reference(self):
+        reports = example_reports()
+        self.assertEqual(make_sections(reports), make_sections_reference(reports))
+
+    def test_sort_by_type(self):
+        reports = example_reports()
+        type2reports = sort_by_type(reports)
+        self.assertEqual(sorted(type2reports), ['r1', 'r2'])
+        self.assertEqual(type2reports['r2'][dict(i=0, c='a')], 'r2-0-a.html')
+        self.assertEqual(len(type2reports['r1']), 12)
+
+    def test_links_table(self):
+        reports = example_reports()
+        r2 = sort_by_type(reports)['r2']
+        table = dict(create_links_html_table(dict(i=1, c='a'), r2))
+        self.assertEqual(table['c'], [('a', None),
+                                      ('b', 'r2-1-b.html')])
+        self.assertEqual(table['i'][1], ('1', None))
+
+
+def get_most_similar_reference(keys, key):
+    """ The previous implementation of get_most_similar(). """
+    scores = np.array([len(set(k.values()) & set(key.values())) for k in keys])
+    if np.sum(scores == np.max(scores)) > 1:
+        return None
+    return keys[int(np.argmax(scores))]
+
+
+class TestValueIndex(unittest.TestCase):
+
+    def test_same_as_reference(self):
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            keys = []
+            for _ in range(rng.randint(1, 8)):
+                k = dict(a=int(rng.randint(3)), b='v%d' % rng.randint(3), c=int(rng.randint(2)))
+                if not k in keys:
+                    keys.append(k)
+            index = ValueIndex(keys)
+            for _ in range(10):
+                key = dict(a=int(rng.randint(4)), b='v%d' % rng.randint(4))
+                self.assertEqual(index.most_similar(key),
+                                 get_most_similar_reference(keys, key))
+
+    def test_no_overlap(self):
+        self.assertEqual(ValueIndex([dict(a=1)]).most_similar(dict(a=2)), dict(a=1))
+        self.assertIsNone(ValueIndex([dict(a=1), dict(a=3)]).most_similar(dict(a=2)))
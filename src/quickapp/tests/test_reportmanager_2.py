@@ -0,0 +1,156 @@
+import json
+import os
+
+from compmake.jobs.dependencies import substitute_dependencies
+from compmake.jobs.storage import get_job, get_job_args
+from nose.tools import istest
+
+from quickapp import QuickApp, iterate_context_names
+from quickapp.report_manager import ReportManager
+from reprep import Report
+
+from .quickappbase import QuickappTest
+
+
+def report_example(param1, param2):
+    r = Report()
+    r.text('param1', '%s' % param1)
+    r.text('param2', '%s' % param2)
+    return r
+
+
+class QuickAppDemoReportCoalesced(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.get_report_manager().set_index_update('coalesced')
+        param1s = ['a', 'b']
+        param2s = [1, 2]
+        for c1, param1 in iterate_context_names(context, param1s, key='param1'):
+            for c2, param2 in iterate_context_names(c1, param2s, key='param2'):
+                r = c2.comp(report_example, param1=param1, param2=param2)
+                c2.add_report(r, 'report_example')
+
+
+@istest
+class ReportManagerCoalescedTest(QuickappTest):
+
+    def test_coalesced_index(self):
+        self.run_quickapp(QuickAppDemoReportCoalesced, cmd='make recurse=1')
+        index = os.path.join(self.root0, 'report.html')
+        self.assertTrue(os.path.exists(index))
+        with open(index) as f:
+            contents = f.read()
+        self.assertEqual(contents.count('<a href='), 4 + 4)  # last 10 + all
+
+
+class QuickAppDemoReportSidecar(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.get_report_manager().set_navigation_mode('sidecar')
+        for c1, param1 in iterate_context_names(context, ['a', 'b'], key='param1'):
+            for c2, param2 in iterate_context_names(c1, [1, 2], key='param2'):
+                r = c2.comp(report_example, param1=param1, param2=param2)
+                c2.add_report(r, 'report_example')
+
+
+@istest
+class ReportManagerSidecarTest(QuickappTest):
+
+    def test_sidecar_navigation(self):
+        self.run_quickapp(QuickAppDemoReportSidecar, cmd='make recurse=1')
+        dirname = os.path.join(self.root0, 'report', 'reportexample')
+        sidecar = os.path.join(dirname, 'reportexample.navigation.js')
+        with open(sidecar) as f:
+            contents = f.read()
+        prefix = 'var quickapp_navigation = '
+        self.assertTrue(contents.startswith(prefix))
+        data = json.loads(contents[len(prefix):].strip().rstrip(';'))
+        self.assertEqual(data['fields'], ['param1', 'param2'])
+        self.assertEqual(data['values'], {'param1': ['a', 'b'], 'param2': ['1', '2']})
+        self.assertEqual(len(data['reports']), 4)
+        for r in data['reports']:
+            page = os.path.join(dirname, r[-1])
+            with open(page) as f:
+                html = f.read()
+            self.assertIn("src='reportexample.navigation.js'", html)
+            self.assertNotIn('<th>param1</th>', html)
+        self.assertTrue(os.path.exists(os.path.join(self.root0, 'report.html')))
+
+
+class QuickAppDemoReportBatch(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.get_report_manager().set_write_processes(2, max_in_flight=1)
+        for c1, param1 in iterate_context_names(context, ['a', 'b'], key='param1'):
+            for c2, param2 in iterate_context_names(c1, [1, 2, 3], key='param2'):
+                r = c2.comp(report_example, param1=param1, param2=param2)
+                c2.add_report(r, 'report_example')
+
+
+@istest
+class ReportManagerBatchTest(QuickappTest):
+
+    def test_batch_write(self):
+        self.run_quickapp(QuickAppDemoReportBatch, cmd='make recurse=1')
+        dirname = os.path.join(self.root0, 'report', 'reportexample')
+        pages = [f for f in os.listdir(dirname) if f.endswith('.html')]
+        self.assertEqual(len(pages), 6)
+        with open(os.path.join(dirname, 'reportexample-b-3.html')) as f:
+            html = f.read()
+        self.assertIn("<table class='variations'>", html)
+        self.assertIn('reportexample-b-1.html', html)
+        with open(os.path.join(self.root0, 'report.html')) as f:
+            contents = f.read()
+        self.assertEqual(contents.count('<a href='), 6 + 6)
+
+
+def define_report(context, param1):
+    r = context.comp(report_example, param1=param1, param2=0)
+    context.add_report(r, 'report_example', param1=param1)
+
+
+class QuickAppDemoReportTreeMerge(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        context.set_merge_fan_in(2)
+        for c1, param1 in iterate_context_names(context, ['a', 'b', 'c', 'd', 'e']):
+            c1.comp_dynamic(define_report, param1)
+
+
+@istest
+class ReportManagerTreeMergeTest(QuickappTest):
+
+    def merge_jobs(self):
+        return [j for j in self.get_jobs('all')
+                if get_job(j, self.db).command_desc == '_dynreports_merge']
+
+    def test_tree_merge(self):
+        self.run_quickapp(QuickAppDemoReportTreeMerge, cmd='make recurse=1')
+        # 6 report managers (root and 5 branches) with fan-in 2,
+        # plus the merge data of each branch
+        self.assertEqual(len(self.merge_jobs()), 3 + 1 + 1 + 5)
+        with open(os.path.join(self.root0, 'report.html')) as f:
+            contents = f.read()
+        self.assertEqual(contents.count('<a href='), 5 + 5)
+
+    def test_merge_inputs(self):
+        self.run_quickapp(QuickAppDemoReportTreeMerge, cmd='make recurse=1')
+        for job_id in self.merge_jobs():
+            _, args, _ = get_job_args(job_id, self.db)
+            branched = substitute_dependencies(args[0], self.db)
+            # only the report managers, not the results of the branches
+            for b in branched:
+                self.assertEqual(list(b), ['report_manager'])
+                self.assertIsInstance(b['report_manager'], ReportManager)
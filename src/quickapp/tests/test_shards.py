@@ -0,0 +1,89 @@
+import os
+
+from compmake import StorageFilesystem
+from compmake.jobs.storage import all_jobs
+from nose.tools import istest
+from reprep import Report
+
+from quickapp import QuickApp, iterate_context_names, quickapp_main
+from quickapp.shards import in_shard, parse_shard
+
+from .quickappbase import QuickappTest
+
+
+def make_report(x):
+    r = Report()
+    r.text('x', '%s' % x)
+    return r
+
+
+class QuickAppDemoShards(QuickApp):
+
+    def define_options(self, params):
+        pass
+
+    def define_jobs_context(self, context):
+        for c, x in iterate_context_names(context, ['v%d' % i for i in range(8)], key='x'):
+            c.add_report(c.comp(make_report, x, job_id='report'), 'values')
+
+
+class QuickAppDemoShardsSummary(QuickAppDemoShards):
+
+    def define_jobs_context(self, context):
+        # defined by every shard
+        context.add_report(context.comp(make_report, 'all', job_id='summary'), 'summary')
+        QuickAppDemoShards.define_jobs_context(self, context)
+
+
+@istest
+class TestShards(QuickappTest):
+
+    def run_app(self, *extra, app=QuickAppDemoShards):
+        args = ['-o', self.root0, '-c', 'make recurse=1'] + list(extra)
+        self.assertEqual(0, quickapp_main(app, args, sys_exit=False))
+
+    def shard_jobs(self, i, n, suffix='-report'):
+        db = StorageFilesystem(os.path.join(self.root0, 'compmake-shard-%d-of-%d' % (i, n)))
+        return set(j for j in all_jobs(db) if j.endswith(suffix))
+
+    def test_shards(self):
+        self.run_app('--shard', '0/2')
+        # merging needs all the shards
+        args = ['-o', self.root0, '--merge_shards', '2']
+        self.assertNotEqual(0, quickapp_main(QuickAppDemoShards, args, sys_exit=False))
+        self.run_app('--shard', '1/2')
+        jobs0 = self.shard_jobs(0, 2)
+        jobs1 = self.shard_jobs(1, 2)
+        self.assertFalse(jobs0 & jobs1)
+        self.assertEqual(jobs0 | jobs1, set('v%d-report' % i for i in range(8)))
+
+        self.assertEqual(0, quickapp_main(QuickAppDemoShards, args, sys_exit=False))
+        with open(os.path.join(self.root0, 'report.html')) as f:
+            index = f.read()
+        for i in range(8):
+            self.assertIn('x = v%d' % i, index)
+
+    def test_shards_summary(self):
+        self.run_app('--shard', '0/2', app=QuickAppDemoShardsSummary)
+        self.run_app('--shard', '1/2', app=QuickAppDemoShardsSummary)
+        # only shard 0 writes the report defined by both
+        self.assertIn('summary-write', self.shard_jobs(0, 2, '-write'))
+        self.assertNotIn('summary-write', self.shard_jobs(1, 2, '-write'))
+        self.assertEqual(len(self.shard_jobs(0, 2, '-write') | self.shard_jobs(1, 2, '-write')),
+                         1 + 8)
+
+        args = ['-o', self.root0, '--merge_shards', '2']
+        self.assertEqual(0, quickapp_main(QuickAppDemoShardsSummary, args, sys_exit=False))
+        self.assertTrue(os.path.exists(os.path.join(self.root0, 'report', 'summary', 'summary.html')))
+        with open(os.path.join(self.root0, 'report.html')) as f:
+            index = f.read()
+        # listed once, like the reports of the sweep
+        self.assertEqual(index.count('summary.html'), index.count('values-v0.html'))
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('1/3'), (1, 3))
+        for s in ['3/3', '-1/3', '1', 'a/b']:
+            self.assertRaises(ValueError, parse_shard, s)
+        keys = ['k%d' % i for i in range(100)]
+        counts = [sum(in_shard(k, (i, 3)) for k in keys) for i in range(3)]
+        self.assertEqual(sum(counts), 100)
@@ -0,0 +1,23 @@
+import unittest
+from tempfile import mkdtemp
+
+from compmake import Context
+from compmake.storage.filesystem import StorageFilesystem
+
+from quickapp.rm import comp_store_shared
+
+
+class TestSharedStore(unittest.TestCase):
+
+    def setUp(self):
+        db = StorageFilesystem(mkdtemp(), compress=True)
+        self.cc = Context(db=db)
+
+    def test_same_content_same_job(self):
+        a = comp_store_shared(self.cc, {'a': [1, 2, 3]}, 'x')
+        b = comp_store_shared(self.cc, {'a': [1, 2, 3]}, 'x')
+        c = comp_store_shared(self.cc, {'a': [1, 2]}, 'x')
+        self.assertEqual(a.job_id, b.job_id)
+        self.assertNotEqual(a.job_id, c.job_id)
+        self.assertIn('dynreports-store-x-', a.job_id)
+        self.assertEqual(len(self.cc.get_jobs_defined_in_this_session()), 2)
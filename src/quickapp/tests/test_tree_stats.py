@@ -0,0 +1,122 @@
+import gc
+
+from nose.tools import istest
+
+from quickapp import QuickAppContext, iterate_context_names
+from quickapp.compmake_context import get_branched_contexts
+from quickapp.app_utils import iterate_context_names_pair
+
+from .quickappbase import QuickappTest
+
+
+def f(x=None):
+    return x
+
+
+def define(context):
+    pass
+
+
+@istest
+class TestTreeStats(QuickappTest):
+
+    def test_tree_stats(self):
+        root = QuickAppContext(cc=self.cc, qapp=None, parent=None, job_prefix=None,
+                               output_dir=self.root0)
+        a = root.child('a')
+        b = a.child('b')
+        c = root.child('c')
+        root.comp(f)
+        b.comp(f)
+        b.comp(f)
+        c.comp(f)
+        self.assertEqual(root.n_comp_invocations, 4)
+        self.assertEqual(a.n_comp_invocations, 2)
+        self.assertEqual(b.n_comp_invocations, 2)
+        self.assertFalse(root.has_branched())
+
+        b.comp_dynamic(define)
+        self.assertTrue(b.has_branched())
+        self.assertTrue(a.has_branched())
+        self.assertTrue(root.has_branched())
+        self.assertFalse(c.has_branched())
+
+        stats = root.tree_stats()
+        self.assertEqual(stats, c.tree_stats())
+        self.assertEqual(stats['n_contexts'], 4)
+        self.assertEqual(stats['n_branched'], 1)
+        # the comp() calls, the 'context' job and the dynamic job
+        self.assertEqual(stats['n_comp_invocations'], 4 + 1 + 1)
+
+    def test_compact_contexts(self):
+        root = QuickAppContext(cc=self.cc, qapp=None, parent=None, job_prefix=None,
+                               output_dir=self.root0)
+        root.add_extra_report_keys(a=1)
+        self.assertFalse(hasattr(root, '__dict__'))
+        # no report keys added: shared with the parent
+        c = root.child('c')
+        self.assertIs(c._report_keys, root._report_keys)
+        # copied when changed
+        c.add_extra_report_keys(b=2)
+        self.assertEqual(c.extra_report_keys, dict(a=1, b=2))
+        self.assertEqual(root.extra_report_keys, dict(a=1))
+        self.assertEqual(c.all_jobs_dict(), {})
+        self.assertEqual(c.branched_contexts, [])
+
+        cells = list(iterate_context_names_pair(root, [1, 2], [3, 4], key1='x', key2='y'))
+        self.assertEqual([cell.extra_report_keys for cell, _, _ in cells],
+                         [dict(a=1, x=x, y=y) for x in [1, 2] for y in [3, 4]])
+
+    def test_mutable_attributes(self):
+        root = QuickAppContext(cc=self.cc, qapp=None, parent=None, job_prefix=None,
+                               output_dir=self.root0)
+        root.add_extra_report_keys(a=1)
+        c1 = root.child('c1')
+        c2 = root.child('c2')
+        # changing the keys of a child does not change the others
+        c1.extra_report_keys['b'] = 2
+        self.assertEqual(root.extra_report_keys, dict(a=1))
+        self.assertEqual(c2.extra_report_keys, dict(a=1))
+        c2.extra_report_keys = dict(c=3)
+        self.assertEqual(c2.extra_report_keys, dict(c=3))
+        root.extra_report_keys['d'] = 4
+        self.assertEqual(c1.extra_report_keys, dict(a=1, b=2))
+
+        c1.branched_contexts.append(c1.comp(f, job_id='fake'))
+        self.assertEqual(len(c1.branched_contexts), 1)
+        self.assertEqual(len(get_branched_contexts(root)), 1)
+
+    def test_children_not_kept(self):
+        root = QuickAppContext(cc=self.cc, qapp=None, parent=None, job_prefix=None,
+                               output_dir=self.root0)
+        a = root.child('a')
+        for x, _ in iterate_context_names(a, list(range(10))):
+            x.comp(f)
+        del x
+        gc.collect()
+        # the children are freed, their counters are not
+        self.assertEqual(a.branched_children, [])
+        self.assertEqual(a.n_comp_invocations, 10)
+        self.assertEqual(root.n_comp_invocations, 10)
+        b = a.child('b')
+        self.assertEqual(a.branched_children, [b])
+
+    def test_counted_in_ancestors(self):
+        root = QuickAppContext(cc=self.cc, qapp=None, parent=None, job_prefix=None,
+                               output_dir=self.root0)
+        a = root.child('a')
+        b = a.child('b')
+        b.comp(f)
+        b.comp_dynamic(define)
+        # the ancestors are updated when the jobs are defined
+        self.assertEqual(a._node.n_comp, 3)
+        self.assertEqual(len(root._node.subtree_branched), 1)
+        # also when the list is replaced
+        p = b.comp(f, job_id='fake')
+        b.branched_contexts = [p]
+        self.assertEqual(get_branched_contexts(a), [p])
+        self.assertEqual(get_branched_contexts(root), [p])
+        del b
+        gc.collect()
+        self.assertEqual(get_branched_contexts(root), [p])
+        self.assertEqual(a.n_comp_invocations, 4)
@@ -0,0 +1,48 @@
+import os
+import unittest
+from tempfile import mkdtemp
+
+from reprep import Report
+
+from quickapp.report_manager import write_report
+
+
+def make_report(text):
+    r = Report('example')
+    r.text('t', text)
+    return r
+
+
+class TestWriteReport(unittest.TestCase):
+
+    def setUp(self):
+        self.d = mkdtemp()
+        self.html = os.path.join(self.d, 'r.html')
+        self.static = os.path.join(self.d, 'static')
+
+    def _write_and_age(self, report, **kwargs):
+        write_report(report, self.html, static_dir=self.static, **kwargs)
+        os.utime(self.html, (0, 0))
+
+    def test_unchanged_not_rewritten(self):
+        self._write_and_age(make_report('a'))
+        self.assertTrue(os.path.exists(self.html + '.sha1'))
+        write_report(make_report('a'), self.html, static_dir=self.static)
+        self.assertEqual(os.path.getmtime(self.html), 0)
+
+    def test_changed_report_rewritten(self):
+        self._write_and_age(make_report('a'))
+        write_report(make_report('b'), self.html, static_dir=self.static)
+        self.assertNotEqual(os.path.getmtime(self.html), 0)
+
+    def test_changed_links_rewritten(self):
+        self._write_and_age(make_report('a'), extra_html_body_start='links1')
+        write_report(make_report('a'), self.html, static_dir=self.static,
+                     extra_html_body_start='links2')
+        self.assertNotEqual(os.path.getmtime(self.html), 0)
+
+    def test_missing_html_rewritten(self):
+        self._write_and_age(make_report('a'))
+        os.unlink(self.html)
+        write_report(make_report('a'), self.html, static_dir=self.static)
+        self.assertTrue(os.path.exists(self.html))
@@ -0,0 +1,82 @@
+__all__ = [
+    'ContextTreeStats',
+    'ContextTreeNode',
+]
+
+
+class ContextTreeStats:
+    """
+        Counters shared by all the contexts in a tree (a root context
+        and its descendants), updated in O(1) when jobs and contexts are
+        defined, so that they never need to be recomputed by visiting
+        the tree.
+    """
+
+    def __init__(self):
+        self.n_contexts = 0
+        self.n_comp_invocations = 0
+        # number of dynamic jobs (comp_dynamic())
+        self.n_branched = 0
+
+    def as_dict(self):
+        return dict(n_contexts=self.n_contexts,
+                    n_comp_invocations=self.n_comp_invocations,
+                    n_branched=self.n_branched)
+
+
+class ContextTreeNode:
+    """
+        What the ancestors of a context need to know about it: its
+        comp() invocations and the promises of its dynamic jobs. They are
+        added to the nodes of the ancestors when the jobs are defined,
+        so that reading them does not visit the descendants.
+
+        A node links to the node of the parent, not to the children, so
+        that the contexts of large grids can be freed once their jobs
+        are defined.
+    """
+    __slots__ = ('parent', 'n_comp', 'branched', 'subtree_branched')
+
+    def __init__(self, parent: "ContextTreeNode" = None):
+        self.parent = parent
+        # comp() invocations in this node and its descendants
+        self.n_comp = 0
+        # promises of the dynamic jobs of this node (created when needed)
+        self.branched = None
+        # the lists 'branched' of this node and its descendants
+        self.subtree_branched = None
+
+    def _ancestors(self):
+        """ Yields this node and its ancestors. """
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def add_comp(self, n: int) -> None:
+        for node in self._ancestors():
+            node.n_comp += n
+
+    def set_branched(self, promises: list) -> None:
+        """ Sets the list of promises of this node, which the ancestors
+            see, also when it is appended to. """
+        old = self.branched
+        self.branched = promises
+        for node in self._ancestors():
+            if node.subtree_branched is None:
+                node.subtree_branched = []
+            lists = node.subtree_branched
+            if old is None:
+                lists.append(promises)
+            else:
+                # by identity: different lists can be equal
+                i = next(i for i, l in enumerate(lists) if l is old)
+                lists[i] = promises
+
+    def branched_promises(self) -> list:
+        """ The promises of this node and its descendants. """
+        res = []
+        if self.subtree_branched:
+            for promises in self.subtree_branched:
+                res.extend(promises)
+        return res
@@ -1,2 +1,3 @@
 
 from .has_logger import *
+from .safe_write import *
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+__all__ = [
+    'atomic_write',
+    'coalesced_update',
+]
+
+
+@contextmanager
+def atomic_write(filename, mode='w'):
+    """
+        Yields a file object for a temporary file in the same directory
+        as filename; when the block completes without errors, the
+        temporary file is renamed to filename, so that readers and
+        concurrent writers never see a partially written file.
+    """
+    dirname = os.path.dirname(filename) or '.'
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(filename) + '.',
+                               suffix='.tmp', dir=dirname)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        # mkstemp() creates the file readable only by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def coalesced_update(lock_filename, update):
+    """
+        Calls update() so that concurrent callers, also across processes,
+        coalesce: if another caller is running update(), we only
+        leave a marker and return; that caller will run update()
+        again after it is done.
+
+        Returns True if update() was called by this caller.
+
+        Without fcntl (Windows), update() is simply called.
+    """
+    if fcntl is None:
+        update()
+        return True
+
+    dirty = lock_filename + '.dirty'
+    # Request an update
+    with open(dirty, 'a'):
+        pass
+
+    called = False
+    # Checking the marker again after releasing the lock covers the
+    # requests that arrived after our last check but before the release.
+    while os.path.exists(dirty):
+        with open(lock_filename, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                # somebody else is updating, and will see the marker
+                return called
+            try:
+                while os.path.exists(dirty):
+                    try:
+                        os.unlink(dirty)
+                    except OSError:
+                        pass
+                    update()
+                    called = True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return called
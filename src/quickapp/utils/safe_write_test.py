@@ -0,0 +1,62 @@
+import fcntl
+import os
+import unittest
+from tempfile import mkdtemp
+
+from quickapp.utils.safe_write import atomic_write, coalesced_update
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def test_replaces(self):
+        fn = os.path.join(mkdtemp(), 'index.html')
+        with atomic_write(fn) as f:
+            f.write('one')
+        with atomic_write(fn) as f:
+            f.write('two')
+        with open(fn) as f:
+            self.assertEqual(f.read(), 'two')
+        self.assertEqual(os.listdir(os.path.dirname(fn)), ['index.html'])
+
+    def test_error_keeps_previous(self):
+        fn = os.path.join(mkdtemp(), 'index.html')
+        with atomic_write(fn) as f:
+            f.write('one')
+        try:
+            with atomic_write(fn) as f:
+                f.write('tw')
+                raise ValueError()
+        except ValueError:
+            pass
+        with open(fn) as f:
+            self.assertEqual(f.read(), 'one')
+        self.assertEqual(os.listdir(os.path.dirname(fn)), ['index.html'])
+
+
+class TestCoalescedUpdate(unittest.TestCase):
+
+    def test_busy_coalesces(self):
+        lock_filename = os.path.join(mkdtemp(), 'index.lock')
+        calls = []
+
+        def update_inner():
+            calls.append('inner')
+
+        def update():
+            calls.append('outer')
+            if len(calls) == 1:
+                # another caller arrives while we hold the lock
+                self.assertFalse(coalesced_update(lock_filename, update_inner))
+
+        # another process holds the lock
+        with open(lock_filename, 'a') as other:
+            fcntl.flock(other, fcntl.LOCK_EX)
+            self.assertFalse(coalesced_update(lock_filename, update))
+            fcntl.flock(other, fcntl.LOCK_UN)
+        self.assertEqual(calls, [])
+
+        # the pending request is served by the next caller, and the request
+        # made during the update causes one more update
+        self.assertTrue(coalesced_update(lock_filename, update))
+        self.assertEqual(calls, ['outer', 'outer'])
+        self.assertFalse(os.path.exists(lock_filename + '.dirty'))